@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""bench_git_ls_date
+
+Benchmark git-ls-date against synthetic repositories built with 'git fast-import'.
+
+Usage:
+  python bench_git_ls_date.py [options] [-- <git-ls-date option>...]
+
+Options:
+  -h --help             Show help.
+  --files=<n>           Number of files.(default: 1000)
+  --commits=<n>         Number of commits.(default: 2000)
+  --merges=<rate>       Rate of commits merged from a side branch.(default: 0.1)
+  --renames=<rate>      Rate of commits renaming a file.(default: 0.05)
+  --depth=<n>           Directory depth of files.(default: 3)
+  --seed=<n>            Random seed of the repository.(default: 0)
+  --repeat=<n>          Run each case n times and keep the fastest.(default: 3)
+  --baseline=<file>     Compare results with baseline file. exit with 1 if regressed.
+  --save=<file>         Save results as baseline file.
+  --tolerance=<rate>    Allowed slowdown against baseline.(default: 0.2)
+
+Each case runs in its own process, and reports wall and cpu time of each phase of
+git-ls-date main() (config, files, log, show), the peak RSS of python and git,
+and the checksum of the output.
+Without git-ls-date options, the default cases are run.
+A case with --jobs fails if it is slower than the same case without --jobs.
+"""
+
+from subprocess import Popen, PIPE
+import sys
+import os
+import getopt
+import json
+import random
+import hashlib
+import tempfile
+import time
+
+import git_ls_date
+
+#=======================================
+# repository
+#=======================================
+
+class RepositoryGenerator(object):
+    """RepositoryGenerator builds a repository with 'git fast-import'."""
+
+    def __init__(self, files = 1000, commits = 2000, merges = 0.1, renames = 0.05, depth = 3, seed = 0):
+        self.files = files
+        self.commits = commits
+        self.merges = merges
+        self.renames = renames
+        self.depth = depth
+        self.seed = seed
+
+        self.path = os.path.join(tempfile.gettempdir(), "git-ls-date-bench",
+                "f%d-c%d-m%s-r%s-d%d-s%d" % (files, commits, merges, renames, depth, seed))
+
+    def generate(self):
+        """create the repository if it does not exist.
+        Return : path of the repository
+        """
+
+        if os.path.exists(os.path.join(self.path, ".git", "index")):
+            return self.path
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        self.__git("init", "-q")
+        process = Popen(["git", "fast-import", "--quiet"], cwd=self.path, stdin=PIPE)
+        process.communicate(self.__stream().encode())
+        if process.returncode:
+            raise git_ls_date.GitCommandErrorException("fast-import", "exit status %d" % process.returncode)
+
+        self.__git("symbolic-ref", "HEAD", "refs/heads/main")
+        self.__git("read-tree", "main")
+        return self.path
+
+    def __git(self, *args):
+        Popen(["git"] + list(args), cwd=self.path).wait()
+
+    def __stream(self):
+        rand = random.Random(self.seed)
+        chunks = []
+        paths = [self.__path(rand, i) for i in range(self.files)]
+        timestamp = 1383000000
+        mark = 0
+        main_mark = None
+
+        for i in range(self.commits):
+            timestamp += rand.randint(60, 86400)
+            mark += 1
+
+            if i == 0:
+                changes = [self.__modify(path, i) for path in paths]
+            else:
+                changes = [self.__modify(path, i) for path in rand.sample(paths, min(len(paths), rand.randint(1, 3)))]
+
+            if i > 0 and rand.random() < self.merges:
+                # commit on side branch, then merge it into main with its changes.
+                chunks.append(self.__commit("side", mark, timestamp, main_mark, None, changes))
+                side_mark = mark
+                mark += 1
+                timestamp += 1
+                chunks.append(self.__commit("main", mark, timestamp, main_mark, side_mark, changes))
+            else:
+                if i > 0 and rand.random() < self.renames:
+                    index = rand.randrange(len(paths))
+                    new_path = self.__path(rand, self.files + i)
+                    changes.append("R %s %s\n" % (paths[index], new_path))
+                    paths[index] = new_path
+                chunks.append(self.__commit("main", mark, timestamp, main_mark, None, changes))
+
+            main_mark = mark
+
+        return "".join(chunks)
+
+    def __path(self, rand, i):
+        directories = ["d%d" % rand.randint(0, 9) for _ in range(self.depth)]
+        return "/".join(directories + ["file%d.txt" % i])
+
+    def __modify(self, path, i):
+        data = "%s %d\n" % (path, i)
+        return "M 100644 inline %s\ndata %d\n%s\n" % (path, len(data), data)
+
+    def __commit(self, branch, mark, timestamp, from_mark, merge_mark, changes):
+        message = "commit %d\n" % mark
+        lines = ["commit refs/heads/%s\n" % branch, "mark :%d\n" % mark,
+                "author bench <bench@example.com> %d +0000\n" % timestamp,
+                "committer bench <bench@example.com> %d +0000\n" % timestamp,
+                "data %d\n%s" % (len(message), message)]
+        if from_mark:
+            lines.append("from :%d\n" % from_mark)
+        if merge_mark:
+            lines.append("merge :%d\n" % merge_mark)
+        return "".join(lines + changes) + "\n"
+
+#=======================================
+# benchmark
+#=======================================
+
+default_cases = [
+    ["--strategy", "scan"],
+    ["--strategy", "scan", "--format", "{ld} {lh} {f}"],
+    ["--strategy", "scan", "--jobs", "4"],
+    ["--strategy", "scan", "--sort", "ld", "--limit", "20"],
+]
+
+class Timer(object):
+
+    def __init__(self):
+        self.phases = []
+        self.__start = self.__now()
+
+    def __now(self):
+        t = os.times()
+        return time.time(), t[0] + t[1], t[2] + t[3]
+
+    def lap(self, name):
+        now = self.__now()
+        self.phases.append({"phase": name, "wall": now[0] - self.__start[0], "cpu": now[1] - self.__start[1],
+                "git_cpu": now[2] - self.__start[2]})
+        self.__start = self.__now()
+
+def run_case(repository, args):
+    """run git-ls-date main() in repository phase by phase.
+    Return : result dict
+    """
+
+    os.chdir(repository)
+    timer = Timer()
+
+    config = git_ls_date.Configuration()
+    config.argparse(args)
+    timer.lap("config")
+
+    files_parser = git_ls_date.FilesParser(config.pathes)
+    timer.lap("files")
+
+    parser = git_ls_date.create_parser(config, files_parser)
+    timer.lap("log")
+
+    stdout = sys.stdout
+    sys.stdout = output = git_ls_date.StringIO()
+    try:
+        git_ls_date.show(config, files_parser, parser)
+    finally:
+        sys.stdout = stdout
+    timer.lap("show")
+
+    return {
+        "phases": timer.phases,
+        "maxrss_kb": git_ls_date.maxrss_kb(),
+        "git_maxrss_kb": git_ls_date.maxrss_kb(children = True),
+        "lines": output.getvalue().count("\n"),
+        "checksum": hashlib.md5(output.getvalue().encode()).hexdigest(),
+    }
+
+def run_case_process(repository, args):
+    """run run_case in a new process, so peak RSS is measured per case."""
+
+    process = Popen([sys.executable, os.path.abspath(__file__), "--run-case", repository, "--"] + args,
+            stdout=PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    stdout, _ = process.communicate()
+    if process.returncode:
+        raise RuntimeError("case failed: %s" % " ".join(args))
+    return json.loads(stdout.decode())
+
+def total(result, key = "wall"):
+    return sum(phase[key] for phase in result["phases"])
+
+def benchmark(repository, cases, repeat):
+    results = {}
+    for args in cases:
+        runs = [run_case_process(repository, args) for _ in range(repeat)]
+        results[" ".join(args)] = min(runs, key=total)
+    return results
+
+def serial_case(name):
+    """name of the case without --jobs, or None if the case runs serially."""
+
+    args = name.split(" ")
+    if "--jobs" not in args:
+        return None
+    i = args.index("--jobs")
+    return " ".join(args[:i] + args[i + 2:])
+
+def report(results, baseline = None, tolerance = 0.2):
+    """print results. return False if some case regressed against baseline,
+    or a parallel case is slower than the same case run serially.
+    """
+
+    ok = True
+    for name in sorted(results):
+        result = results[name]
+        phases = "  ".join("%s %.3fs" % (p["phase"], p["wall"]) for p in result["phases"])
+        print("%s\n    total %.3fs  cpu %.3fs  git cpu %.3fs  rss %dKB  git rss %dKB  %d lines\n    %s" % (
+            name, total(result), total(result, "cpu"), total(result, "git_cpu"),
+            result["maxrss_kb"], result["git_maxrss_kb"], result["lines"], phases))
+
+        serial = results.get(serial_case(name))
+        # parallel walks are compared in the same run, so no baseline is needed to catch them.
+        if serial and total(result) > total(serial) * (1 + tolerance) and total(result) - total(serial) > 0.05:
+            print("    SLOWER THAN SERIAL %.3fs -> %.3fs" % (total(serial), total(result)))
+            ok = False
+
+        base = baseline.get(name) if baseline else None
+        if not base:
+            continue
+
+        if base["checksum"] != result["checksum"]:
+            print("    OUTPUT CHANGED")
+            ok = False
+        # ignore noise of very short runs.
+        if total(result) > total(base) * (1 + tolerance) and total(result) - total(base) > 0.05:
+            print("    REGRESSION %.3fs -> %.3fs" % (total(base), total(result)))
+            ok = False
+
+    return ok
+
+#=======================================
+# main
+#=======================================
+
+def main():
+    args = sys.argv[1:]
+
+    if args and args[0] == "--run-case":
+        print(json.dumps(run_case(args[1], args[3:])))
+        return
+
+    try:
+        opts, ls_date_args = getopt.getopt(args, "h", ["help", "files=", "commits=", "merges=", "renames=",
+            "depth=", "seed=", "repeat=", "baseline=", "save=", "tolerance="])
+    except getopt.GetoptError as e:
+        print(__doc__)
+        sys.exit(1)
+
+    params = {}
+    repeat = 3
+    baseline_path = None
+    save_path = None
+    tolerance = 0.2
+
+    for opt, value in opts:
+        if opt == "--help" or opt == "-h":
+            print(__doc__)
+            sys.exit()
+        elif opt in ("--files", "--commits", "--depth", "--seed"):
+            params[opt[2:]] = int(value)
+        elif opt in ("--merges", "--renames"):
+            params[opt[2:]] = float(value)
+        elif opt == "--repeat":
+            repeat = int(value)
+        elif opt == "--baseline":
+            baseline_path = value
+        elif opt == "--save":
+            save_path = value
+        elif opt == "--tolerance":
+            tolerance = float(value)
+
+    generator = RepositoryGenerator(**params)
+    start = time.time()
+    repository = generator.generate()
+    print("repository %s (%.1fs)\n" % (repository, time.time() - start))
+
+    results = benchmark(repository, [ls_date_args] if ls_date_args else default_cases, repeat)
+
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    ok = report(results, baseline, tolerance)
+
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -25,15 +25,69 @@
 """git-ls-date
 
 Usage:
-  git ls-date [--date=<option>] [--format=<format>] [<path>]...
+  git ls-date [--date=<option>] [--format=<format>] [--sort=<key>] [--reverse] [--limit=<n>]
+              [--cache] [--index] [--import-index=<file>] [--jobs=<n>] [--strategy=<strategy>]
+              [--follow-renames] [--merges=<policy>] [--tree[=<depth>]] [--output=<style>] [--connect] [--profile]
+              [--rev=<rev>...] [--since=<date>] [--until=<date>] [--max-commits=<n>] [<path>]...
+  git ls-date [options] (--repo=<repo>... | --repos-from=<file> | --recurse-submodules) [--repo-jobs=<n>] [<path>]...
+  git ls-date --export-index=<file> [--cache] [--jobs=<n>] [--follow-renames] [--merges=<policy>]
+  git ls-date --serve [--cache] [--jobs=<n>] [--follow-renames] [--merges=<policy>]
   git ls-date -h | --help
   git ls-date -v | --version
 
 Options:
   -h --help                                             Show help.
   -v --version                                          Show version.
-  -d --date=(relative|local|default|iso|rfc|short|raw)  Date option.(default: short)
+  -d --date=<option>                                    Date option of 'git log --date', like relative, local, iso,
+                                                        iso-strict, rfc, short, raw, unix, human or format:<strftime>.
+                                                        '-local' variants are accepted too.(default: short)
   -f --format=<format>                                  Show-format option. See SHOW FORMAT.(default: "{fd} {fh}  {ld} {lh}  {f}")
+  -s --sort=(ld|fd|f)                                   Sort files by last commit date, first commit date or filename.
+                                                        older dates come first.
+  -r --reverse                                          Reverse sort order.
+  -n --limit=<n>                                        Show only first n files.
+  -o --output=(text|jsonl|csv|z)                        Output style. text writes format per line, and z ends it with
+                                                        NUL instead. jsonl and csv write values of placeholders in
+                                                        format without padding.(default: text)
+  --tree[=<depth>]                                      Show directories instead of files. a directory has the oldest
+                                                        first commit and the newest last commit of files under it.
+                                                        directories deeper than depth are merged into their parent.
+  --profile                                             Write time, git processes and memory usage to stderr as JSON.
+                                                        GIT_LS_DATE_PROFILE=1 does the same.
+  --cache                                               Keep first and last commits in .git/ls-date-cache and
+                                                        walk only new commits on the next run.
+  --export-index=<file>                                 Write first and last commits of every file at HEAD to file, which
+                                                        is compressed and checksummed, and exit.
+  --import-index=<file>                                 Start from file written by --export-index. if its commit is an
+                                                        ancestor of HEAD, only commits after it are walked.
+  --index                                               Keep first and last commits in binary .git/ls-date-index and
+                                                        look up given files in it without listing files.
+                                                        it is rebuilt when HEAD moved.
+  -j --jobs=<n>                                         Split files into n shards of top-level directories and
+                                                        walk history of them in parallel.(default: 1)
+  --strategy=(auto|scan|targeted)                       scan walks history once for all files. targeted runs
+                                                        'git log' per file. auto chooses cheaper one.(default: auto)
+  --follow-renames                                      Follow renames of files in the same history walk, so first commit
+                                                        is the one which added the file under its oldest name.
+  --merges=(combined|first-parent|skip)                 How merge commits are walked. See MERGES.(default: combined)
+  --rev=<rev>                                           Show files in the tree of rev with commits reachable from it,
+                                                        instead of files in the index and HEAD. it can be given many
+                                                        times, and history shared by revs is walked once.
+                                                        with many revs, --follow-renames is not supported.
+  --since=<date>                                        Walk only commits newer than date, like 'git log --since'.
+                                                        first commits are the oldest ones in the window.
+  --until=<date>                                        Walk only commits older than date, like 'git log --until'.
+  --max-commits=<n>                                     Walk only the newest n commits changing given files.
+  --serve                                               Keep first and last commits in memory and answer queries
+                                                        over .git/ls-date.sock.
+  --connect                                             Ask the running server. if it is not running, run as usual.
+  --repo=<repo>                                         Show files of repository. it can be given many times.
+                                                        paths are relative to each repository.
+  --repos-from=<file>                                   Read repository paths from file, one per line. - is stdin.
+  --recurse-submodules                                  Show files of checked out submodules too.
+  --repo-jobs=<n>                                       Number of repositories processed at once.(default: number of CPUs)
+                                                        output is in order of repositories. a failed repository is
+                                                        reported to stderr and the others go on.
 
 SHOW FORMAT:
 
@@ -45,15 +99,80 @@ SHOW FORMAT:
     * {fd}: first commit date
     * {lh}: last commit hash
     * {fh}: first commit hash
-    * {f}:  filename
+    * {f}:  filename. with --tree, directory path
+    * {d}:  directory path
+    * {nf}: number of files. without --tree, 1
+    * {r}:  repository path. "." without --repo
+    * {rv}: revision given by --rev. "HEAD" without --rev
+    * {st}: "untouched" if the file has no commit in the walked history, "boundary" if its first
+            commit is the boundary of a shallow clone, so the file can be older. otherwise empty
+    * {n}:  number of commits. with --tree, sum of files
+    * {la}: last commit author
+    * {fa}: first commit author
+    * {na}: number of authors
+
+  {n}, {la}, {fa} and {na} are counted in the same history walk, without --cache or --index.
+
+  date placeholders can take their own date option, like {ld:iso} or {fd:relative: <20}.
+
+MERGES:
+
+  * combined:     all commits are walked. a merge counts for a file only if the merge
+                  changed it differently from every parent, like a conflict resolution.
+                  git computes combined diff of every merge.
+  * first-parent: only first parents are walked. a merge counts for every file it brought
+                  in, so dates are when changes reached the current branch, and commits
+                  on merged branches are not seen.
+  * skip:         all commits except merges are walked, and merges never count.
+                  changes made only in merges are missed. this is the cheapest.
 
 See https://github.com/ton1517/git-ls-date
 """
 
 from subprocess import Popen, PIPE
 import sys
+import os
+import copy
+import socket
+import signal
 import getopt
 import re
+import string
+import json
+import time
+import heapq
+import threading
+import posixpath
+import shlex
+import fnmatch
+import struct
+import csv
+import mmap
+import binascii
+import hashlib
+import zlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    from sys import intern
+except ImportError:
+    pass
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+def intern_string(s):
+    """intern string. builtin intern of Python 2 accepts only byte str, so unicode is returned as it is."""
+
+    return intern(s) if type(s) is str else s
 
 #=======================================
 # config
@@ -78,11 +197,37 @@ def usage():
 def version():
     print("%s %s" % (_name, _version))
 
+def format_fields(format):
+    """return placeholder names used in format.
+    Arg : show-format string
+    Return : set of placeholder names
+    """
+
+    return set(field for _, field, _, _ in string.Formatter().parse(format) if field is not None)
+
+# placeholders which need every commit of files. LogCache and LogIndex keep only both ends.
+statistics_fields = ["n", "na", "la", "fa"]
+
+# placeholders which need commits of files. the others are answered by names of files.
+commit_fields = ["ld", "lh", "fd", "fh", "st"] + statistics_fields
+
+def needs_statistics(format):
+    """return True if format uses statistics_fields."""
+
+    return bool(format_fields(format) & set(statistics_fields))
+
 class Configuration(object):
     """parse comannd option and set configuration."""
 
-    shortopts = "hvd:f:"
-    longopts = ["help", "version", "date=", "format="]
+    shortopts = "hvd:f:s:rn:j:o:"
+    longopts = ["help", "version", "date=", "format=", "sort=", "reverse", "limit=", "cache", "index", "export-index=", "import-index=", "jobs=", "strategy=",
+            "serve", "connect", "profile", "follow-renames", "merges=", "tree=", "output=", "repo=", "repos-from=", "recurse-submodules", "repo-jobs=", "rev=", "since=", "until=",
+            "max-commits="]
+
+    sort_keys = ["ld", "fd", "f"]
+    strategies = ["auto", "scan", "targeted"]
+    merge_policies = ["combined", "first-parent", "skip"]
+    outputs = ["text", "jsonl", "csv", "z"]
 
     date_default = "short"
     format_default =  "{fd} {fh}  {ld} {lh}  {f}"
@@ -96,20 +241,57 @@ class Configuration(object):
 
         self.date = self.__config_hash.get("date", self.date_default)
         self.format = self.__config_hash.get("format",self.format_default)
+        self.sort = self.__config_hash.get("sort")
+        self.reverse = False
+        self.limit = None
+        self.cache = config_bool(self.__config_hash.get("cache", "false"))
+        self.index = config_bool(self.__config_hash.get("index", "false"))
+        self.export_index = None
+        self.import_index = None
+        self.jobs = self.__config_hash.get("jobs", 1)
+        self.strategy = self.__config_hash.get("strategy", "auto")
+        self.serve = False
+        self.follow_renames = config_bool(self.__config_hash.get("follow-renames", "false"))
+        self.merges = self.__config_hash.get("merges", "combined")
+        self.tree = None
+        self.output = self.__config_hash.get("output", "text")
+        self.repos = []
+        self.revs = []
+        self.revision = None
+        self.since = None
+        self.until = None
+        self.max_commits = None
+        self.recurse_submodules = False
+        self.repo_jobs = self.__config_hash.get("repo-jobs", multiprocessing.cpu_count())
+
+    def __read_repos(self, path):
+        try:
+            if path == "-":
+                lines = sys.stdin.read().split("\n")
+            else:
+                with open(path) as f:
+                    lines = f.read().split("\n")
+        except IOError as e:
+            print("Invalid repos-from error.")
+            print(e)
+            sys.exit(1)
 
-    def __read_gitconfig(self):
-        config_lines = git("config --get-regexp " + _name).split("\n")[:-1]
+        return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
 
-        config_re = re.compile("%s\.(.*?) (.*)" % _name)
-        for line in config_lines:
-            result = config_re.search(line)
-            self.__config_hash[result.group(1)] = result.group(2)
+    def __read_gitconfig(self):
+        self.__config_hash = read_gitconfig(_name)
 
     def argparse(self, args = []):
         """parse commandline arguments.
         Arg : commandline arguments. you should exclude commandline name.
                 for example 'configuration.argparse(sys.argv[1:])'
         """
+        # getopt does not support optional value. '--tree' takes the next argument without this.
+        if "--" in args:
+            args = [arg if arg != "--tree" else "--tree=" for arg in args[:args.index("--")]] + args[args.index("--"):]
+        else:
+            args = [arg if arg != "--tree" else "--tree=" for arg in args]
+
         try:
             opts, args = getopt.getopt(args, self.shortopts, self.longopts)
         except getopt.GetoptError as e:
@@ -132,16 +314,345 @@ class Configuration(object):
             elif opt == "--format" or opt == "-f":
                 self.format = value
                 try:
-                    self.format.format(ld="",fd="",lh="",fh="",f="")
+                    self.format.format(ld=DateField(no_commit),fd=DateField(no_commit),lh="",fh="",f="",d="",nf=0,r="",rv="",st="",n=0,la="",fa="",na=0)
                 except (KeyError, ValueError) as e:
                     print("Invalid format error.")
                     print(e)
                     sys.exit(1)
+            elif opt == "--sort" or opt == "-s":
+                self.sort = value
+            elif opt == "--reverse" or opt == "-r":
+                self.reverse = True
+            elif opt == "--limit" or opt == "-n":
+                self.limit = value
+            elif opt == "--cache":
+                self.cache = True
+            elif opt == "--index":
+                self.index = True
+            elif opt == "--export-index":
+                self.export_index = value
+            elif opt == "--import-index":
+                self.import_index = value
+            elif opt == "--jobs" or opt == "-j":
+                self.jobs = value
+            elif opt == "--strategy":
+                self.strategy = value
+            elif opt == "--serve":
+                self.serve = True
+            elif opt == "--follow-renames":
+                self.follow_renames = True
+            elif opt == "--merges":
+                self.merges = value
+            elif opt == "--tree":
+                self.tree = value
+            elif opt == "--output" or opt == "-o":
+                self.output = value
+            elif opt == "--rev":
+                self.revs.append(value)
+            elif opt == "--since":
+                self.since = value
+            elif opt == "--until":
+                self.until = value
+            elif opt == "--max-commits":
+                self.max_commits = value
+            elif opt == "--repo":
+                self.repos.append(value)
+            elif opt == "--repos-from":
+                self.repos.extend(self.__read_repos(value))
+            elif opt == "--recurse-submodules":
+                self.recurse_submodules = True
+            elif opt == "--repo-jobs":
+                self.repo_jobs = value
+            elif opt == "--connect" or opt == "--profile":
+                # handled before configuration is read.
+                pass
 
             else:
                 usage()
                 sys.exit(1)
 
+        if self.sort is not None and self.sort not in self.sort_keys:
+            print("Invalid sort error.")
+            print(self.sort)
+            sys.exit(1)
+
+        if self.limit is not None:
+            try:
+                self.limit = int(self.limit)
+                if self.limit < 0:
+                    raise ValueError(self.limit)
+            except ValueError as e:
+                print("Invalid limit error.")
+                print(e)
+                sys.exit(1)
+
+        if self.strategy not in self.strategies:
+            print("Invalid strategy error.")
+            print(self.strategy)
+            sys.exit(1)
+
+        if self.max_commits is not None:
+            try:
+                self.max_commits = int(self.max_commits)
+                if self.max_commits < 1:
+                    raise ValueError(self.max_commits)
+            except ValueError as e:
+                print("Invalid max-commits error.")
+                print(e)
+                sys.exit(1)
+
+        if len(self.revs) > 1 and self.follow_renames:
+            print("Invalid rev error.")
+            print("--follow-renames takes only one --rev.")
+            sys.exit(1)
+        # one revision is walked as usual. many revisions are walked by RevisionsLogParser.
+        self.revision = self.revs[0] if len(self.revs) == 1 else None
+
+        if self.tree is not None:
+            try:
+                # -1 is unlimited depth.
+                self.tree = int(self.tree) if self.tree else -1
+                if self.tree < -1:
+                    raise ValueError(self.tree)
+            except ValueError as e:
+                print("Invalid tree error.")
+                print(e)
+                sys.exit(1)
+
+        try:
+            self.repo_jobs = int(self.repo_jobs)
+            if self.repo_jobs < 1:
+                raise ValueError(self.repo_jobs)
+        except ValueError as e:
+            print("Invalid repo-jobs error.")
+            print(e)
+            sys.exit(1)
+
+        if self.output not in self.outputs:
+            print("Invalid output error.")
+            print(self.output)
+            sys.exit(1)
+
+        if self.merges not in self.merge_policies:
+            print("Invalid merges error.")
+            print(self.merges)
+            sys.exit(1)
+
+        try:
+            self.jobs = int(self.jobs)
+            if self.jobs < 1:
+                raise ValueError(self.jobs)
+        except ValueError as e:
+            print("Invalid jobs error.")
+            print(e)
+            sys.exit(1)
+
+#=======================================
+# date
+#=======================================
+
+# styles of 'git log --date'. every style has '-local' variant too, like 'iso-local'.
+# 'format:<strftime format>', 'format-local:<strftime format>' and 'auto:<style>' are accepted also.
+date_options = ["relative", "local", "default", "iso", "iso8601", "iso-strict", "iso8601-strict", "rfc", "rfc2822",
+        "short", "raw", "unix", "human"]
+_date_aliases = {"iso8601": "iso", "iso8601-strict": "iso-strict", "rfc2822": "rfc"}
+
+_weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+_months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+_date_cache = {}
+_parsed_date_options = {}
+
+def parse_date_option(date_option):
+    """parse date option like git.
+    Arg : date option
+    Return : (style, whether in local timezone, strftime format of 'format' style or None).
+            if date_option is unknown, return None.
+    """
+
+    parsed = _parsed_date_options.get(date_option)
+    if parsed is None and date_option not in _parsed_date_options:
+        parsed = _parsed_date_options[date_option] = _parse_date_option(date_option)
+    return parsed
+
+def _parse_date_option(date_option):
+    if date_option.startswith("auto:"):
+        # git uses the style only for terminal.
+        return parse_date_option(date_option[5:] if sys.stdout.isatty() else "default")
+
+    for prefix, local in [("format:", False), ("format-local:", True)]:
+        if date_option.startswith(prefix):
+            return "format", local, date_option[len(prefix):]
+
+    style, local = date_option, False
+    if style.endswith("-local"):
+        style, local = style[:-6], True
+    if style == "local" and not local:
+        style, local = "default", True
+    elif style not in date_options or style == "local":
+        return None
+
+    return _date_aliases.get(style, style), local, None
+
+def check_date_option(date_option):
+    """raise GitCommandErrorException like git, if date_option is unknown."""
+
+    if parse_date_option(date_option) is None:
+        raise GitCommandErrorException("--date=%s" % date_option, "fatal: unknown date format %s\n" % date_option)
+
+def format_date(timestamp, tz, date_option):
+    """render author date like 'git log --date=<date_option>'.
+    Arg : unix timestamp, timezone offset like '+0900', date option
+    Return : date string. if timestamp is None, return empty string.
+    """
+
+    if timestamp is None:
+        return ""
+
+    style, local, strftime_format = parse_date_option(date_option)
+
+    # relative and human dates change over time, so they are not memoized.
+    if style == "relative":
+        return format_relative_date(timestamp)
+    if style == "human":
+        return format_human_date(timestamp, local_tz(timestamp) if local else tz, local)
+
+    key = (timestamp, tz, date_option)
+    date = _date_cache.get(key)
+    if date is None:
+        if local:
+            tz = local_tz(timestamp)
+        date = _date_cache[key] = _format_date(timestamp, tz, style, local, strftime_format)
+    return date
+
+def local_tz(timestamp):
+    """return offset of the local timezone at timestamp like '+0900'."""
+
+    t = time.localtime(timestamp)
+    offset = getattr(t, "tm_gmtoff", None)
+    if offset is None:
+        offset = -(time.altzone if t.tm_isdst > 0 else time.timezone)
+    return "%s%02d%02d" % ("-" if offset < 0 else "+", abs(offset) // 3600, abs(offset) % 3600 // 60)
+
+def _tz_time(timestamp, tz):
+    offset = (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60) * (-1 if tz[0] == "-" else 1)
+    return time.gmtime(timestamp + offset)
+
+def _format_date(timestamp, tz, style, local, strftime_format):
+    if style == "raw":
+        return "%d %s" % (timestamp, tz)
+    if style == "unix":
+        return "%d" % timestamp
+
+    t = _tz_time(timestamp, tz)
+
+    if style == "short":
+        return "%04d-%02d-%02d" % (t.tm_year, t.tm_mon, t.tm_mday)
+    elif style == "iso":
+        return "%04d-%02d-%02d %02d:%02d:%02d %s" % (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, tz)
+    elif style == "iso-strict":
+        return "%04d-%02d-%02dT%02d:%02d:%02d%s:%s" % (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec,
+                tz[:3], tz[3:])
+    elif style == "rfc":
+        return "%s, %d %s %04d %02d:%02d:%02d %s" % (_weekdays[t.tm_wday], t.tm_mday, _months[t.tm_mon - 1],
+                t.tm_year, t.tm_hour, t.tm_min, t.tm_sec, tz)
+    elif style == "format":
+        return _strftime(strftime_format, t, timestamp, tz, local)
+
+    date = "%s %s %d %02d:%02d:%02d %d" % (_weekdays[t.tm_wday], _months[t.tm_mon - 1], t.tm_mday,
+            t.tm_hour, t.tm_min, t.tm_sec, t.tm_year)
+    return date if local else date + " " + tz
+
+_strftime_re = re.compile(r"%(.)")
+
+def _strftime(strftime_format, t, timestamp, tz, local):
+    # like git, %z is the offset of the date, %s is the timestamp and %Z is empty unless local.
+    def replace(match):
+        c = match.group(1)
+        if c == "z":
+            return tz
+        if c == "s":
+            return "%d" % timestamp
+        if c == "Z" and not local:
+            return ""
+        return match.group(0)
+
+    return time.strftime(_strftime_re.sub(replace, strftime_format), t if not local else time.localtime(timestamp))
+
+def format_human_date(timestamp, tz, local = False, now = None):
+    """render date like 'git log --date=human'.
+    details are hidden as the date is closer to now in the local timezone.
+    """
+
+    now = int(time.time() if now is None else now)
+    now_tz = local_tz(now)
+    t, now_t = _tz_time(timestamp, tz), _tz_time(now, now_tz)
+
+    hide_year = t.tm_year == now_t.tm_year
+    hide_date = hide_wday = False
+    if hide_year and t.tm_mon == now_t.tm_mon:
+        if t.tm_mday == now_t.tm_mday:
+            hide_date = hide_wday = True
+        elif t.tm_mday < now_t.tm_mday < t.tm_mday + 5:
+            # a few days ago shows weekday only.
+            hide_date = True
+
+    # today is relative.
+    if hide_wday:
+        return format_relative_date(timestamp, now)
+
+    hide_tz = local or tz == now_tz or not hide_date
+    hide_wday = hide_time = not hide_year
+
+    parts = []
+    if not hide_wday:
+        parts.append(_weekdays[t.tm_wday])
+    if not hide_date:
+        parts.append("%s %d" % (_months[t.tm_mon - 1], t.tm_mday))
+    if not hide_time:
+        parts.append("%02d:%02d" % (t.tm_hour, t.tm_min))
+    if not hide_year:
+        parts.append("%d" % t.tm_year)
+    if not hide_tz:
+        parts.append(tz)
+    return " ".join(parts)
+
+def _plural(n, unit):
+    return "%d %s%s" % (n, unit, "" if n == 1 else "s")
+
+def format_relative_date(timestamp, now = None):
+    """render date like 'git log --date=relative'."""
+
+    diff = int(time.time() if now is None else now) - timestamp
+    if diff < 0:
+        return "in the future"
+    if diff < 90:
+        return _plural(diff, "second") + " ago"
+
+    diff = (diff + 30) // 60
+    if diff < 90:
+        return _plural(diff, "minute") + " ago"
+
+    diff = (diff + 30) // 60
+    if diff < 36:
+        return _plural(diff, "hour") + " ago"
+
+    diff = (diff + 12) // 24
+    if diff < 14:
+        return _plural(diff, "day") + " ago"
+    if diff < 70:
+        return _plural((diff + 3) // 7, "week") + " ago"
+    if diff < 365:
+        return _plural((diff + 15) // 30, "month") + " ago"
+    if diff < 1825:
+        total_months = (diff * 12 * 2 + 365) // (365 * 2)
+        years, months = divmod(total_months, 12)
+        if months:
+            return "%s, %s ago" % (_plural(years, "year"), _plural(months, "month"))
+        return _plural(years, "year") + " ago"
+
+    return _plural((diff + 183) // 365, "year") + " ago"
+
 #=======================================
 # git
 #=======================================
@@ -156,33 +667,566 @@ class GitCommandErrorException(Exception):
     def __str__(self):
         return self.command + "\n" + self.message
 
-def git(cmd):
-    """run git command.
+def git_args(cmd):
+    """return git argument list.
+    Arg : command string split by whitespace, or argument list
+    """
+
+    return cmd.split() if isinstance(cmd, str) else list(cmd)
+
+def maxrss_kb(children = False):
+    """return peak RSS in KB of this process, or of its waited children.
+    ru_maxrss is in bytes on macOS, in KB elsewhere.
+    """
+
+    import resource
+
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+class Profiler(object):
+    """Profiler records time of each phase, git processes and parsed log size.
+    it records nothing until start() is called.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.phases = []
+        self.processes = []
+        self.commits = 0
+        self.file_entries = 0
+        self.__times = None
+
+    def start(self):
+        self.enabled = True
+        self.reset()
+        self.__times = self.__now()
+
+    def __now(self):
+        t = os.times()
+        return time.time(), t[0] + t[1], t[2] + t[3]
+
+    def lap(self, name):
+        """record time since previous lap as phase name."""
+
+        if not self.enabled:
+            return
+
+        now = self.__now()
+        self.phases.append({"phase": name, "wall": now[0] - self.__times[0], "cpu": now[1] - self.__times[1],
+                "git_cpu": now[2] - self.__times[2]})
+        self.__times = now
+
+    def add_process(self, args, wall, bytes_read, read_wait = None):
+        if not self.enabled:
+            return
+
+        process = {"args": " ".join(args[:6]), "wall": wall, "bytes": bytes_read}
+        if read_wait is not None:
+            process["read_wait"] = read_wait
+        with self.__lock:
+            self.processes.append(process)
+
+    def add_log(self, commits, file_entries):
+        if not self.enabled:
+            return
+
+        with self.__lock:
+            self.commits += commits
+            self.file_entries += file_entries
+
+    def stats(self):
+        return {"processes": self.processes, "commits": self.commits, "file_entries": self.file_entries}
+
+    def merge(self, stats):
+        """merge stats() of other process."""
+
+        with self.__lock:
+            self.processes += stats["processes"]
+            self.commits += stats["commits"]
+            self.file_entries += stats["file_entries"]
+
+    def report(self, stream = None):
+        """write report as JSON."""
+
+        report = self.stats()
+        report["phases"] = self.phases
+        report["git_processes"] = len(self.processes)
+        report["bytes_read"] = sum(p["bytes"] for p in self.processes)
+        report["maxrss_kb"] = maxrss_kb()
+        report["git_maxrss_kb"] = maxrss_kb(children = True)
+
+        stream = stream or sys.stderr
+        json.dump(report, stream, indent=2, sort_keys=True)
+        stream.write("\n")
+
+profile = Profiler()
+
+def git(cmd, input = None, cwd = None):
+    """run git command without shell.
+    Arg : command string or argument list. input is written to stdin.
+            cwd is directory to run git in. default is the current directory.
     Return : return command output string
     Raise : GitCommandErrorException
     """
 
-    stdout, stderr = Popen("git " + cmd, shell=True, stdout=PIPE, stdin=PIPE, stderr=PIPE).communicate()
+    args = git_args(cmd)
+    start = time.time()
+    process = Popen(["git"] + args, stdout=PIPE, stdin=PIPE, stderr=PIPE, cwd=cwd)
+    stdout, stderr = process.communicate(input.encode() if input else None)
+    profile.add_process(args, time.time() - start, len(stdout))
 
     if stderr:
-        raise GitCommandErrorException(cmd, stderr.decode())
+        raise GitCommandErrorException(" ".join(args), stderr.decode())
 
     return stdout.decode()
 
+def git_lines(cmd, input = None, separator = "\n", cwd = None):
+    """run git command and read its output incrementally.
+    Arg : command string or argument list. input is written to stdin.
+            separator splits output into records, like "\\0" for '-z' output.
+            cwd is directory to run git in. default is the current directory.
+    Return : generator yielding output records without trailing separator
+    Raise : GitCommandErrorException
+
+    if the generator is closed before the output is exhausted,
+    the git process is killed.
+    """
+
+    args = git_args(cmd)
+    start = time.time()
+    process = Popen(["git"] + args, stdout=PIPE, stdin=PIPE, stderr=PIPE, cwd=cwd)
+    if input:
+        process.stdin.write(input.encode())
+    process.stdin.close()
+
+    if separator == "\n":
+        records = process.stdout
+    else:
+        records = _split_stream(process.stdout, separator.encode())
+
+    bytes_read = 0
+    read_wait = 0.0
+    finished = False
+    try:
+        if profile.enabled:
+            # time spent waiting for git is measured separately from parsing.
+            records = iter(records)
+            while True:
+                read_start = time.time()
+                record = next(records, None)
+                read_wait += time.time() - read_start
+                if record is None:
+                    break
+                bytes_read += len(record)
+                yield record.decode().rstrip(separator)
+        else:
+            for record in records:
+                yield record.decode().rstrip(separator)
+        finished = True
+    finally:
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        process.wait()
+        profile.add_process(args, time.time() - start, bytes_read, read_wait)
+
+    if stderr:
+        raise GitCommandErrorException(" ".join(args), stderr.decode())
+
+def _split_stream(stream, separator):
+    """yield records of stream ending with separator. the last record may not end with it."""
+
+    rest = b""
+    while True:
+        chunk = os.read(stream.fileno(), 65536)
+        if not chunk:
+            break
+        records = (rest + chunk).split(separator)
+        rest = records.pop()
+        for record in records:
+            yield record + separator
+    if rest:
+        yield rest
+
+_quoted_path_re = re.compile(r'\\([0-7]{3}|.)')
+_quoted_path_escapes = {"a": "\a", "b": "\b", "t": "\t", "n": "\n", "v": "\v", "f": "\f", "r": "\r"}
+
+def unquote_path(path):
+    """decode path quoted by git like '"a\\tb"'. if path is not quoted, return it as is."""
+
+    if not path.startswith('"'):
+        return path
+
+    def replace(match):
+        escape = match.group(1)
+        if len(escape) == 3:
+            # code point of the byte, which is encoded back to the byte by latin-1.
+            return unichr(int(escape, 8))
+        return _quoted_path_escapes.get(escape, escape)
+
+    # octal escapes are bytes of utf-8.
+    unquoted = _quoted_path_re.sub(replace, path[1:-1])
+    return unquoted.encode("latin-1").decode("utf-8", "replace")
+
+#=======================================
+# repository
+#=======================================
+
+def find_repository(cwd = None):
+    """find repository of the directory without running git.
+    Arg : directory. default is the current directory.
+    Return : (git dir, common dir, top-level directory)
+    """
+
+    cwd = os.path.abspath(cwd or os.curdir)
+    repository = _find_repository(cwd)
+    if not repository:
+        # GIT_DIR, bare repositories, ... are left to git.
+        git_dir, common_dir, cdup = git("rev-parse --git-dir --git-common-dir --show-cdup", cwd=cwd).split("\n")[:3]
+        repository = tuple(os.path.normpath(os.path.join(cwd, path)) for path in [git_dir, common_dir, cdup])
+
+    return repository
+
+def _find_repository(directory):
+    if "GIT_DIR" in os.environ or "GIT_WORK_TREE" in os.environ:
+        return None
+
+    while True:
+        dot_git = os.path.join(directory, ".git")
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        if os.path.isfile(dot_git):
+            # worktrees and submodules have '.git' file like 'gitdir: <path>'.
+            with open(dot_git) as f:
+                content = f.read().strip()
+            if not content.startswith("gitdir: "):
+                return None
+            git_dir = os.path.normpath(os.path.join(directory, content[8:]))
+            break
+
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+    common_dir = git_dir
+    commondir_path = os.path.join(git_dir, "commondir")
+    if os.path.exists(commondir_path):
+        with open(commondir_path) as f:
+            common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+
+    return git_dir, common_dir, directory
+
+def get_prefix(cwd = None):
+    """return path of the directory from top-level like 'git rev-parse --show-prefix' without '/'.
+    Arg : directory. default is the current directory.
+    """
+
+    top = find_repository(cwd)[2]
+    prefix = os.path.relpath(os.path.abspath(cwd or os.curdir), top).replace(os.sep, "/")
+    return "" if prefix == "." else prefix
+
+def relative_path(full, prefix):
+    """return path relative to prefix, same as 'git ls-files' shows.
+    Arg : path from top-level, prefix from get_prefix()
+    """
+
+    if not prefix:
+        return full
+    if full.startswith(prefix + "/"):
+        return full[len(prefix) + 1:]
+    return posixpath.relpath(full, prefix)
+
+def read_head(cwd = None):
+    """return commit id of HEAD without running git if possible.
+    Arg : directory in the repository. default is the current directory.
+    """
+
+    git_dir, common_dir, _ = find_repository(cwd)
+
+    with open(os.path.join(git_dir, "HEAD")) as f:
+        head = f.read().strip()
+    if not head.startswith("ref: "):
+        return head
+
+    ref = head[5:]
+    for directory in [git_dir, common_dir]:
+        ref_path = os.path.join(directory, ref)
+        if os.path.isfile(ref_path):
+            with open(ref_path) as f:
+                return f.read().strip()
+
+    packed_refs = os.path.join(common_dir, "packed-refs")
+    if os.path.exists(packed_refs):
+        with open(packed_refs) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+
+    # unborn branch, reftable, ...
+    return git("rev-parse HEAD", cwd=cwd).strip()
+
+def read_shallow(cwd = None):
+    """return boundary commits of shallow clone without running git.
+    Arg : directory in the repository. default is the current directory.
+    Return : set of commit ids. empty if the repository is not shallow.
+    """
+
+    _, common_dir, _ = find_repository(cwd)
+
+    shallow_path = os.path.join(common_dir, "shallow")
+    if not os.path.exists(shallow_path):
+        return set()
+    with open(shallow_path) as f:
+        return set(f.read().split())
+
+#=======================================
+# gitconfig
+#=======================================
+
+_config_section_re = re.compile(r'^\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+_config_key_re = re.compile(r'^([A-Za-z][-A-Za-z0-9]*)\s*(=?)')
+
+def config_bool(value):
+    """return value of gitconfig as bool like git."""
+
+    return value.strip().lower() in ["true", "yes", "on", "1"]
+
+def gitconfig_paths():
+    """return system, global and local gitconfig paths in order of precedence. later one wins."""
+
+    paths = []
+
+    if not config_bool(os.environ.get("GIT_CONFIG_NOSYSTEM", "false")):
+        paths.append(os.environ.get("GIT_CONFIG_SYSTEM", "/etc/gitconfig"))
+
+    if "GIT_CONFIG_GLOBAL" in os.environ:
+        paths.append(os.environ["GIT_CONFIG_GLOBAL"])
+    else:
+        xdg = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+        paths.append(os.path.join(xdg, "git", "config"))
+        paths.append(os.path.join(os.path.expanduser("~"), ".gitconfig"))
+
+    # out of repository, there is no local config.
+    try:
+        paths.append(os.path.join(find_repository()[1], "config"))
+    except GitCommandErrorException:
+        pass
+    return paths
+
+def read_gitconfig(section):
+    """read variables of section from gitconfig files without running git.
+    include.path and includeIf "gitdir:", "gitdir/i:", "onbranch:" are followed.
+    'git -c' and GIT_CONFIG_COUNT variables are read too.
+    Arg : section name
+    Return : dict of variable name to value
+    """
+
+    values = {}
+    for path in gitconfig_paths():
+        parse_gitconfig(path, section.lower(), values)
+
+    for key, value in _environment_config():
+        name, _, variable = key.rpartition(".")
+        if name.lower() == section.lower():
+            values[variable.lower()] = value
+
+    return values
+
+def _environment_config():
+    variables = []
+
+    # 'git -c key=value ls-date' passes them through GIT_CONFIG_PARAMETERS.
+    for parameter in shlex.split(os.environ.get("GIT_CONFIG_PARAMETERS", "")):
+        key, _, value = parameter.partition("=")
+        variables.append((key, value))
+
+    for i in range(int(os.environ.get("GIT_CONFIG_COUNT", "0") or 0)):
+        variables.append((os.environ.get("GIT_CONFIG_KEY_%d" % i, ""), os.environ.get("GIT_CONFIG_VALUE_%d" % i, "")))
+
+    return variables
+
+def parse_gitconfig(path, section, values, depth = 0):
+    """parse gitconfig file and set variables of section into values."""
+
+    if depth > 10 or not os.path.isfile(path):
+        return
+
+    with open(path) as f:
+        lines = f.read().split("\n")
+
+    current = None
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+
+        if not line or line[0] in "#;":
+            continue
+
+        if line[0] == "[":
+            match = _config_section_re.match(line)
+            if not match:
+                continue
+            name, subsection = match.group(1).lower(), match.group(2)
+            if subsection is None and "." in name:
+                # deprecated [section.subsection] syntax.
+                name, subsection = name.split(".", 1)
+            current = (name, subsection)
+            line = line[match.end():].strip()
+            if not line or line[0] in "#;":
+                continue
+
+        match = _config_key_re.match(line)
+        if not match or current is None:
+            continue
+
+        key = match.group(1).lower()
+        if not match.group(2):
+            value = "true"
+        else:
+            raw = line[match.end():]
+            # a value continues to next line if it ends with backslash.
+            while raw.endswith("\\") and not raw.endswith("\\\\") and i < len(lines):
+                raw = raw[:-1] + lines[i]
+                i += 1
+            value = _parse_config_value(raw)
+
+        name, subsection = current
+        if name == section and subsection is None:
+            values[key] = value
+        elif name == "include" and subsection is None and key == "path":
+            parse_gitconfig(_config_include_path(path, value), section, values, depth + 1)
+        elif name == "includeif" and key == "path" and _include_if(path, subsection):
+            parse_gitconfig(_config_include_path(path, value), section, values, depth + 1)
+
+def _parse_config_value(raw):
+    value = []
+    quoted = False
+    pending_space = ""
+    i = 0
+    while i < len(raw):
+        c = raw[i]
+        i += 1
+        if c == "\\" and i < len(raw):
+            c = raw[i]
+            i += 1
+            value.append(pending_space + {"n": "\n", "t": "\t", "b": "\b"}.get(c, c))
+            pending_space = ""
+        elif c == '"':
+            quoted = not quoted
+        elif not quoted and c in "#;":
+            break
+        elif not quoted and c.isspace():
+            if value:
+                pending_space += c
+        else:
+            value.append(pending_space + c)
+            pending_space = ""
+    return "".join(value)
+
+def _config_include_path(config_path, path):
+    path = os.path.expanduser(path)
+    return os.path.join(os.path.dirname(config_path), path)
+
+def _include_if(config_path, condition):
+    if not condition:
+        return False
+
+    kind, _, pattern = condition.partition(":")
+
+    if kind in ["gitdir", "gitdir/i"]:
+        pattern = os.path.expanduser(pattern)
+        if pattern.startswith("./"):
+            pattern = os.path.join(os.path.dirname(config_path), pattern[2:])
+        elif not os.path.isabs(pattern):
+            pattern = "**/" + pattern
+        if pattern.endswith("/"):
+            pattern += "**"
+
+        try:
+            git_dir = os.path.abspath(find_repository()[0])
+        except GitCommandErrorException:
+            # outside of a repository.
+            return False
+        if kind == "gitdir/i":
+            return fnmatch.fnmatch(git_dir.lower(), pattern.lower())
+        return fnmatch.fnmatchcase(git_dir, pattern)
+
+    if kind == "onbranch":
+        try:
+            git_dir = find_repository()[0]
+        except GitCommandErrorException:
+            return False
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if not head.startswith("ref: refs/heads/"):
+            return False
+        if pattern.endswith("/"):
+            pattern += "**"
+        return fnmatch.fnmatchcase(head[16:], pattern)
+
+    return False
+
 class Commit(object):
+    """commit with raw author date. date is rendered with date_option."""
 
-    def __init__(self, date, hash):
-        self.date = date
+    __slots__ = ("timestamp", "tz", "hash", "date_option", "author")
+
+    def __init__(self, timestamp, tz, hash, date_option = "local", author = None):
+        self.timestamp = timestamp
+        self.tz = tz
         self.hash = hash
+        self.date_option = date_option
+        self.author = author
+
+    @property
+    def date(self):
+        return format_date(self.timestamp, self.tz, self.date_option)
 
     def __str__(self):
         return "%s %s" % (self.date, self.hash)
 
+no_commit = Commit(None, None, "")
+
+class DateField(object):
+    """value of date placeholders.
+    format spec can start with date option, for example '{ld:iso}' or '{fd:relative: <20}'.
+    """
+
+    __slots__ = ("commit",)
+
+    def __init__(self, commit):
+        self.commit = commit
+
+    def __format__(self, spec):
+        date_option, _, rest = spec.partition(":")
+        if parse_date_option(date_option):
+            return format(format_date(self.commit.timestamp, self.commit.tz, date_option), rest)
+        return format(self.commit.date, spec)
+
 class FilesParser(object):
-    """FilesParser run 'git ls-files' and parse."""
+    """FilesParser run 'git ls-files' and parse.
+    pathes and files are relative to cwd. default is the current directory.
+    with revision, files in the tree of the revision are listed by 'git ls-tree'.
+    """
+
+    ls_files_format = ["ls-files", "-z", "--full-name", "--"]
+    ls_tree_format = ["ls-tree", "-r", "-z", "--name-only", "--full-name"]
 
-    def __init__(self, pathes = []):
+    def __init__(self, pathes = [], cwd = None, revision = None):
         self.pathes = pathes if type(pathes) is list else [pathes]
+        self.cwd = cwd
+        self.revision = revision
 
         self.__abbrev_to_full = {}
         self.__full_to_abbrev = {}
@@ -192,11 +1236,57 @@ class FilesParser(object):
 
         self.__parse_files()
 
+    @classmethod
+    def from_files(cls, files, files_full, cwd = None, pathes = None):
+        """create FilesParser from already listed files without running git.
+        Arg : filenames and their full paths, directory which filenames are relative to,
+                pathspecs matching the files. default is the files themselves without wildcards.
+        Return : FilesParser object
+        """
+
+        parser = cls.__new__(cls)
+        parser.pathes = pathes if pathes is not None else [":(literal)" + f for f in files]
+        parser.cwd = cwd
+        parser.revision = None
+        parser.__abbrev_to_full = {}
+        parser.__full_to_abbrev = {}
+        parser.files = files
+        parser.files_full = files_full
+        parser.__map_files()
+        return parser
+
+    @classmethod
+    def from_output(cls, output, pathes = [], cwd = None):
+        """create FilesParser from output of ls_files_format already run in cwd.
+        Arg : output string, pathes given to 'git ls-files', directory
+        Return : FilesParser object
+        """
+
+        parser = cls.__new__(cls)
+        parser.pathes = pathes
+        parser.cwd = cwd
+        parser.revision = None
+        parser.__abbrev_to_full = {}
+        parser.__full_to_abbrev = {}
+        parser.__parse_output(output)
+        return parser
+
     def __parse_files(self):
-        args = " ".join(["\'%s\'" % f for f in self.pathes])
-        self.files = git("ls-files "+args).split("\n")[:-1]
-        self.files_full = git("ls-files --full-name "+args).split("\n")[:-1]
+        if self.revision:
+            self.__parse_output(git(self.ls_tree_format + [self.revision, "--"] + self.pathes, cwd=self.cwd))
+        else:
+            self.__parse_output(git(self.ls_files_format + self.pathes, cwd=self.cwd))
+
+    def __parse_output(self, output):
+        self.files_full = output.split("\0")[:-1]
+
+        # paths relative to the current directory, same as 'git ls-files' shows.
+        prefix = get_prefix(self.cwd)
+        self.files = [relative_path(full, prefix) for full in self.files_full]
 
+        self.__map_files()
+
+    def __map_files(self):
         for i, f in enumerate(self.files):
             full = self.files_full[i]
             self.__abbrev_to_full[f] = full
@@ -221,52 +1311,315 @@ class FilesParser(object):
         return self.__full_to_abbrev.get(full_path)
 
 class LogParser(object):
-    """LogParser runs 'git log' and parse."""
+    """LogParser runs 'git log' and parse.
+    with authors, commits have author names and authors of each file are counted.
+    """
 
-    log_format = "log --oneline --name-only --author-date-order -c --pretty=format:'%h %ad' --date="
+    # commit lines start with \\x01, which git quotes in filenames.
+    log_format = ["log", "--oneline", "--name-only", "--author-date-order", "--pretty=format:%x01%h %ad", "--date=raw"]
+    log_format_renames = ["log", "--name-status", "-M", "-z", "--author-date-order", "--pretty=format:%h %ad",
+            "--date=raw"]
+    merge_args = {"combined": ["-c"], "first-parent": ["-m", "--first-parent"], "skip": ["--no-merges"]}
 
-    def __init__(self, files_parser, date_option = None):
+    def __init__(self, files_parser, date_option = None, last_only = False, revision = None, compact = False, jobs = 1,
+            follow_renames = False, merges = "combined", lazy = False, authors = False, window = []):
         self.files_parser = files_parser
-        self.date_option = date_option
+        self.date_option = date_option if date_option else "local"
+        self.last_only = last_only
+        self.revision = revision
+        self.compact = compact
+        self.jobs = jobs
+        self.follow_renames = follow_renames
+        self.merges = merges
+        self.authors = authors
+        self.window = window
 
         self.commits = []
         self.__commit_contains_file_hash = {}
 
-        self.files_quote = ["\'%s\'"%f for f in self.files_parser.files]
-        self.log_format += date_option if date_option else "local"
-
-        self.__parse_log()
+        # path of each file at the oldest commit walked, if it was renamed.
+        self.__origin_path_hash = {}
+
+        # compact mode keeps only both ends and the number of commits per file.
+        self.__first_commit_hash = {}
+        self.__last_commit_hash = {}
+        self.__commit_count_hash = {}
+
+        # author names of each file. names are shared, so a file costs a pointer per author.
+        self.__authors_hash = {}
+        self.__author_names = {}
+
+        check_date_option(self.date_option)
+        log_format = self.log_format_renames if follow_renames else self.log_format
+        if authors:
+            # author is the last field, since it can contain spaces.
+            log_format = [arg + " %an" if arg.startswith("--pretty=") else arg for arg in log_format]
+        self.log_args = log_format + self.merge_args[merges] + window + ["--stdin"]
+        if revision:
+            self.log_args.append(revision)
+
+        # lazy parser walks history in iter_resolved().
+        if lazy:
+            return
+
+        # only compact results can be merged from shards.
+        # renames cross shards, so following them needs one walk. so does --max-count.
+        if (self.compact and self.jobs > 1 and len(self.files_parser.files) > 1 and not follow_renames and
+                not any(arg.startswith("--max-count=") for arg in window)):
+            self.__parse_log_parallel()
+        else:
+            self.__parse_log()
+
+    def __parse_log_parallel(self):
+        files = self.files_parser.files
+        files_full = self.files_parser.files_full
+
+        shards = split_shards(files_full, self.jobs, self.__pathspecs(), get_prefix(self.files_parser.cwd))
+        if not shards or len(shards) < 2:
+            # files are in one directory, or pathspecs can not be split by directory.
+            self.__parse_log()
+            return
+
+        shard_args = []
+        for shard, pathspecs in shards:
+            shard_files = [files[i] for i in shard]
+            shard_files_full = [files_full[i] for i in shard]
+            shard_args.append((shard_files, shard_files_full, pathspecs, self.date_option, self.last_only,
+                self.revision, self.merges, self.authors, self.window, self.files_parser.cwd, profile.enabled))
+
+        pool = multiprocessing.Pool(len(shard_args))
+        try:
+            results = pool.map(_parse_log_shard, shard_args)
+        finally:
+            pool.close()
+            pool.join()
+
+        for result, stats in results:
+            if stats:
+                profile.merge(stats)
+
+            for full, (first, last, count, authors) in result.items():
+                if first:
+                    self.__first_commit_hash[full] = Commit(first[0], intern_string(first[1]), first[2], self.date_option,
+                            self.__author_name(first[3]))
+                self.__last_commit_hash[full] = Commit(last[0], intern_string(last[1]), last[2], self.date_option,
+                        self.__author_name(last[3]))
+                self.__commit_count_hash[full] = count
+                if authors is not None:
+                    self.__authors_hash[full] = set(self.__author_name(a) for a in authors)
 
     def __parse_log(self):
-        log_str = git(self.log_format+" "+" ".join(self.files_quote))[:-1].split("\n\n")
+        for _ in self.__walk():
+            pass
+
+    def iter_resolved(self, lines = None):
+        """walk history for parser created with lazy = True.
+        Arg : output records of log_command() if caller ran it. default is to run git.
+        Return : generator yielding full path of each file as soon as its last commit is found.
+                first commits and commit counts are complete when the generator is exhausted.
+        """
+
+        return self.__walk(lines)
+
+    def log_command(self):
+        """return git command of this parser, for callers running git by themselves.
+        Return : (argument list, stdin input, separator of output records)
+        """
+
+        # renamed files come from paths out of pathspecs. whole tree is walked.
+        if self.follow_renames:
+            return self.log_args, "--\n", "\0"
+
+        pathspecs = self.__pathspecs()
+        if any("\n" in pathspec for pathspec in pathspecs):
+            # stdin is read line by line. such pathspecs are given as arguments.
+            return self.log_args + ["--"] + pathspecs, "--\n", "\n"
+        return self.log_args, "--\n" + "".join(pathspec + "\n" for pathspec in pathspecs), "\n"
+
+    def __walk(self, lines = None):
+        if lines is None:
+            args, input, separator = self.log_command()
+            lines = git_lines(args, input, separator, self.files_parser.cwd)
+        lines = iter(lines)
+
+        if self.follow_renames:
+            commits = self.__iter_commits_following_renames(lines)
+        else:
+            commits = (self.__parse_one_commit_contains_filename(c) for c in self.__iter_commits(lines))
+
+        unresolved = set(self.files_parser.files_full)
+        commits_count = 0
+        file_entries_count = 0
+
+        try:
+            for commit, files in commits:
+                commits_count += 1
+                file_entries_count += len(files)
+
+                if self.compact:
+                    for f in files:
+                        self.__update_endpoints(f, commit)
+                else:
+                    self.commits.append(commit)
+                    for f in files:
+                        self.__append_commit(f, commit)
+
+                if unresolved:
+                    for f in files:
+                        if f in unresolved:
+                            unresolved.remove(f)
+                            yield f
+
+                if self.last_only and not unresolved:
+                    # every file has its last commit. stop walking history.
+                    break
+        finally:
+            # if history is not read to the end, git is killed.
+            if hasattr(lines, "close"):
+                lines.close()
+            profile.add_log(commits_count, file_entries_count)
+
+    def __pathspecs(self):
+        """return pathspecs for 'git log --stdin'.
+        pathspecs listed files are given, not the files, so git matches a few of them
+        against changes of each commit. they are given through stdin, so command line
+        does not grow with them.
+        Return : list of pathspecs. empty list is the whole tree.
+        """
 
-        for l in log_str:
-            one_commit = l.split("\n")
-            date, hash, files = self.__parse_one_commit_contains_filename(one_commit)
-            commit = Commit(date, hash)
-            self.commits.append(commit)
+        # ':/' or no path at top-level is the whole tree. no pathspec is needed.
+        pathes = self.files_parser.pathes
+        if ":/" in pathes:
+            return []
+        if not pathes:
+            return ["."] if get_prefix(self.files_parser.cwd) else []
+        return pathes
+
+    def __iter_commits(self, lines):
+        """group streamed log lines into one list per commit.
+        Arg : iterable of log lines
+        Return : generator yielding [commit info, filename, ...]
+        """
 
-            for f in files:
-                self.__append_commit(f, commit)
+        # commits without filename, like merges, are not followed by blank line.
+        one_commit = []
+        for line in lines:
+            if line.startswith("\x01"):
+                if one_commit:
+                    yield one_commit
+                one_commit = [line[1:]]
+            elif line:
+                one_commit.append(line)
+
+        if one_commit:
+            yield one_commit
+
+    def __iter_commits_following_renames(self, records):
+        """parse 'git log --name-status -z' output and resolve changed paths to current files.
+        each current file has aliases, which are its paths before renames found so far.
+        Arg : iterable of NUL-separated log records
+        Return : generator yielding (commit, current full paths)
+        """
+
+        aliases = dict((f, f) for f in self.files_parser.files_full)
+        records = iter(records)
+        commit = None
+        files = []
+
+        for record in records:
+            if not record:
+                # end of commit.
+                continue
+
+            if "\n" in record:
+                header, status = record.split("\n", 1)
+            elif " " in record:
+                # commit without changes like merge.
+                header, status = record, None
+            else:
+                header, status = None, record
+
+            if header is not None:
+                if commit:
+                    yield commit, files
+                commit = self.__parse_one_commit(header)
+                files = []
+            if not status:
+                continue
+
+            path = next(records)
+            # combined diff has one status letter per parent and one path.
+            if status[0] not in "RC" or not status[1:].isdigit():
+                current = aliases.get(path)
+                if current:
+                    files.append(current)
+                continue
+
+            new_path = next(records)
+            current = aliases.get(new_path)
+            if status[0] == "R":
+                # before this commit, new path did not exist and old path was this file.
+                aliases.pop(new_path, None)
+                if current:
+                    aliases[path] = current
+                    self.__origin_path_hash[current] = path
+                else:
+                    aliases.pop(path, None)
+            if current:
+                files.append(current)
+
+        if commit:
+            yield commit, files
 
     def __append_commit(self, key_file, commit):
         commit_list = self.__commit_contains_file_hash.get(key_file, [])
         commit_list.append(commit)
         self.__commit_contains_file_hash[key_file] = commit_list
 
+    def __update_endpoints(self, key_file, commit):
+        # log is read from newest to oldest.
+        if key_file not in self.__last_commit_hash:
+            self.__last_commit_hash[key_file] = commit
+        self.__first_commit_hash[key_file] = commit
+        self.__commit_count_hash[key_file] = self.__commit_count_hash.get(key_file, 0) + 1
+        if self.authors:
+            authors = self.__authors_hash.get(key_file)
+            if authors is None:
+                authors = self.__authors_hash[key_file] = set()
+            authors.add(commit.author)
+
     def __parse_one_commit_contains_filename(self, one_commit):
         commit_info = one_commit[0]
-        date, hash = self.__parse_one_commit(commit_info)
-        files = one_commit[1:]
-        return date, hash, files
+        commit = self.__parse_one_commit(commit_info)
+        files = [unquote_path(f) for f in one_commit[1:]]
+        return commit, files
 
     def __parse_one_commit(self, one_commit):
-        return one_commit[8:], one_commit[:7]
+        if self.authors:
+            hash, timestamp, tz, author = one_commit.split(" ", 3)
+            return Commit(int(timestamp), intern_string(tz), hash, self.date_option, self.__author_name(author))
+
+        hash, timestamp, tz = one_commit.split(" ")
+        return Commit(int(timestamp), intern_string(tz), hash, self.date_option)
+
+    def __author_name(self, author):
+        if author is None:
+            return None
+        return self.__author_names.setdefault(author, author)
+
+    def get_origin_path(self, file):
+        """return full path of file at the oldest commit walked.
+        Arg : filename
+        Return : full path. if file was not renamed or renames are not followed, return its full path.
+        """
+
+        full_path = self.files_parser.get_full(file)
+        return self.__origin_path_hash.get(full_path, full_path)
 
     def get_commits_contains(self, file):
         """return commits that contains file.
         Arg : filename
-        Return : commit list. if file has no commit, return None.
+        Return : commit list. if file has no commit or parser is compact, return None.
         """
 
         full_path = self.files_parser.get_full(file)
@@ -276,9 +1629,15 @@ class LogParser(object):
     def get_first_commit_contains(self, file):
         """return commit that file are changed last.
         Arg : filename
-        Return : commit object
+        Return : commit object. if parser is last_only, return None.
         """
 
+        if self.last_only:
+            return None
+
+        if self.compact:
+            return self.__first_commit_hash.get(self.files_parser.get_full(file))
+
         commits = self.get_commits_contains(file)
         return commits[-1] if commits else None
 
@@ -288,30 +1647,1549 @@ class LogParser(object):
         Return : commit object
         """
 
+        if self.compact:
+            return self.__last_commit_hash.get(self.files_parser.get_full(file))
+
         commits = self.get_commits_contains(file)
         return commits[0] if commits else None
 
+    def get_commit_count_contains(self, file):
+        """return the number of commits that contains file.
+        Arg : filename
+        Return : commit count. if file has no commit, return 0.
+        """
+
+        if self.compact:
+            return self.__commit_count_hash.get(self.files_parser.get_full(file), 0)
+
+        commits = self.get_commits_contains(file)
+        return len(commits) if commits else 0
+
+    def get_authors_contains(self, file):
+        """return author names of commits that contains file.
+        Arg : filename
+        Return : set of author names. if parser is not created with authors, return None.
+        """
+
+        if not self.authors:
+            return None
+
+        if self.compact:
+            return self.__authors_hash.get(self.files_parser.get_full(file), set())
+
+        return set(commit.author for commit in self.get_commits_contains(file) or [])
+
+def pathspec_top(pathspec, prefix, top_files):
+    """return top-level directory of files which pathspec matches.
+    Arg : pathspec relative to prefix, prefix from get_prefix(), set of files at top-level
+    Return : name of the directory, "" for files at top-level, or None if it may match files of
+            several directories.
+    """
+
+    literal = pathspec.startswith(":(literal)")
+    if literal:
+        pathspec = pathspec[len(":(literal)"):]
+    elif pathspec.startswith(":"):
+        return None
+
+    wildcards = [i for i in [pathspec.find(c) for c in "*?[\\"] if i >= 0] if not literal else []
+    if wildcards:
+        # wildcards match '/' too, so directories before them are fixed only.
+        pathspec = pathspec[:min(wildcards)].rpartition("/")[0]
+
+    full = posixpath.normpath(posixpath.join(prefix, pathspec))
+    if full == "." or full == ".." or full.startswith("../"):
+        return None
+
+    top, separator, _ = full.partition("/")
+    if not separator and not wildcards and full in top_files:
+        return ""
+    return top
+
+def split_shards(files_full, jobs, pathspecs = [], prefix = ""):
+    """split files into shards of whole top-level directories.
+    each shard is walked with given pathspecs of its directories. if none is given, the whole tree
+    is split by pathspecs of directories, not of files, since git matches every pathspec against
+    changes of every commit.
+    files at top-level are one group. groups are assigned to the smallest shard, largest first.
+    Arg : full paths, number of shards, pathspecs which files are listed with, prefix of pathspecs
+    Return : list of (index list, pathspecs). shards are never empty.
+            None if some of pathspecs may match files of several directories.
+    """
+
+    groups = {}
+    for i, full in enumerate(files_full):
+        top, separator, _ = full.partition("/")
+        groups.setdefault(top if separator else "", []).append(i)
+
+    if pathspecs:
+        top_files = set(full for full in files_full if "/" not in full)
+        group_pathspecs = {}
+        for pathspec in pathspecs:
+            top = pathspec_top(pathspec, prefix, top_files)
+            if top is None:
+                return None
+            group_pathspecs.setdefault(top, []).append(pathspec)
+        if any(top not in group_pathspecs for top in groups):
+            return None
+    else:
+        # '*' of glob magic does not match '/', so it is files at top-level.
+        group_pathspecs = dict((top, [":(top,literal)" + top if top else ":(top,glob)*"]) for top in groups)
+
+    shards = [([], []) for _ in range(min(jobs, len(groups)))]
+    for top in sorted(groups, key=lambda top: (-len(groups[top]), top)):
+        indexes, shard_pathspecs = min(shards, key=lambda shard: len(shard[0]))
+        indexes.extend(groups[top])
+        shard_pathspecs.extend(group_pathspecs[top])
+
+    return [(sorted(indexes), shard_pathspecs) for indexes, shard_pathspecs in shards]
+
+def _parse_log_shard(args):
+    """worker of LogParser jobs. this must be top level to be pickled."""
+
+    files, files_full, pathspecs, date_option, last_only, revision, merges, authors, window, cwd, profile_enabled = args
+
+    if profile_enabled:
+        profile.start()
+
+    files_parser = FilesParser.from_files(files, files_full, cwd, pathspecs)
+    parser = LogParser(files_parser, date_option, last_only, revision, compact = True, merges = merges,
+            authors = authors, window = window)
+
+    result = {}
+    for full in files_full:
+        fc = parser.get_first_commit_contains(full)
+        lc = parser.get_last_commit_contains(full)
+        if lc:
+            file_authors = parser.get_authors_contains(full)
+            result[full] = ((fc.timestamp, fc.tz, fc.hash, fc.author) if fc else None,
+                    (lc.timestamp, lc.tz, lc.hash, lc.author), parser.get_commit_count_contains(full),
+                    list(file_authors) if file_authors is not None else None)
+    return result, profile.stats() if profile_enabled else None
+
+#=======================================
+# revisions
+#=======================================
+
+class RevisionLog(object):
+    """first and last commits of files as of one revision, filled by RevisionsLogParser."""
+
+    def __init__(self, files_parser, authors = False):
+        self.files_parser = files_parser
+        self.first_commits = {}
+        self.last_commits = {}
+        self.commit_counts = {}
+        self.authors = {} if authors else None
+
+    def add(self, full, commit):
+        # log is read from newest to oldest.
+        if full not in self.last_commits:
+            self.last_commits[full] = commit
+        self.first_commits[full] = commit
+        self.commit_counts[full] = self.commit_counts.get(full, 0) + 1
+        if self.authors is not None:
+            authors = self.authors.get(full)
+            if authors is None:
+                authors = self.authors[full] = set()
+            authors.add(commit.author)
+
+    def get_first_commit_contains(self, file):
+        """return commit that file are added first.
+        Arg : filename
+        Return : commit object. if file has no commit, return None.
+        """
+
+        return self.first_commits.get(self.files_parser.get_full(file))
+
+    def get_last_commit_contains(self, file):
+        """return commit that file are changed last.
+        Arg : filename
+        Return : commit object. if file has no commit, return None.
+        """
+
+        return self.last_commits.get(self.files_parser.get_full(file))
+
+    def get_commit_count_contains(self, file):
+        """return the number of commits that contains file.
+        Arg : filename
+        Return : commit count. if file has no commit, return 0.
+        """
+
+        return self.commit_counts.get(self.files_parser.get_full(file), 0)
+
+    def get_authors_contains(self, file):
+        """return author names of commits that contains file.
+        Arg : filename
+        Return : set of author names. if authors are not counted, return None.
+        """
+
+        if self.authors is None:
+            return None
+        return self.authors.get(self.files_parser.get_full(file), set())
+
+class RevisionsLogParser(object):
+    """RevisionsLogParser answers first and last commits of files as of many revisions
+    from one walk of their history.
+
+    each commit has a bit mask of revisions which contain it. log shows no parent
+    before its children, so masks are passed from children to parents while walking,
+    and a commit changing a file counts for every revision in its mask.
+    shared history is walked once however many revisions contain it.
+    """
+
+    # commit lines are '\x01<hash> <parents>\x01<abbrev hash> <date>'.
+    log_format = ["log", "--name-only", "--author-date-order", "--pretty=format:%x01%H %P%x01%h %ad", "--date=raw"]
+    # merges are shown without files to pass masks to their parents, instead of --no-merges.
+    merge_args = {"combined": ["-c"], "first-parent": ["-m", "--first-parent"], "skip": []}
+
+    def __init__(self, revisions, pathes = [], date_option = None, merges = "combined", authors = False, cwd = None,
+            window = []):
+        self.revisions = revisions
+        self.date_option = date_option if date_option else "local"
+        self.merges = merges
+        self.authors = authors
+        self.cwd = cwd
+
+        check_date_option(self.date_option)
+        log_format = self.log_format
+        if authors:
+            # author is the last field, since it can contain spaces.
+            log_format = [arg + " %an" if arg.startswith("--pretty=") else arg for arg in log_format]
+        self.log_args = log_format + self.merge_args[merges] + window
+
+        self.logs = [RevisionLog(FilesParser(pathes, cwd, revision), authors) for revision in revisions]
+        self.__author_names = {}
+
+        self.__parse_log()
+
+    def for_revision(self, index):
+        """return files and commits as of a revision.
+        Arg : index of the revision in revisions
+        Return : FilesParser object, RevisionLog object
+        """
+
+        log = self.logs[index]
+        return log.files_parser, log
+
+    def __parse_log(self):
+        tips = git(["rev-parse"] + [revision + "^{commit}" for revision in self.revisions], cwd=self.cwd).split()
+
+        masks = {}
+        for i, tip in enumerate(tips):
+            masks[tip] = masks.get(tip, 0) | (1 << i)
+
+        # files of any revision. changes of other paths are skipped.
+        wanted = set()
+        for log in self.logs:
+            wanted.update(log.files_parser.files_full)
+
+        # logs of revisions in each mask.
+        mask_logs = {}
+        first_parent = self.merges == "first-parent"
+
+        commits_count = 0
+        file_entries_count = 0
+        lines = git_lines(self.log_args + sorted(set(tips)) + ["--"], cwd=self.cwd)
+        try:
+            commit = logs = None
+            for line in lines:
+                if line.startswith("\x01"):
+                    _, graph, info = line.split("\x01", 2)
+                    graph = graph.split(" ")
+                    mask = masks.pop(graph[0], 0)
+                    for parent in graph[1:2] if first_parent else graph[1:]:
+                        if parent:
+                            masks[parent] = masks.get(parent, 0) | mask
+
+                    logs = mask_logs.get(mask)
+                    if logs is None:
+                        logs = mask_logs[mask] = [log for i, log in enumerate(self.logs) if mask >> i & 1]
+                    commit = self.__parse_one_commit(info)
+                    commits_count += 1
+                elif line:
+                    full = unquote_path(line)
+                    file_entries_count += 1
+                    if full in wanted:
+                        for log in logs:
+                            log.add(full, commit)
+        finally:
+            lines.close()
+            profile.add_log(commits_count, file_entries_count)
+
+    def __parse_one_commit(self, one_commit):
+        if self.authors:
+            hash, timestamp, tz, author = one_commit.split(" ", 3)
+            author = self.__author_names.setdefault(author, author)
+            return Commit(int(timestamp), intern_string(tz), hash, self.date_option, author)
+
+        hash, timestamp, tz = one_commit.split(" ")
+        return Commit(int(timestamp), intern_string(tz), hash, self.date_option)
+
+#=======================================
+# planner
+#=======================================
+
+class TargetedLogParser(object):
+    """TargetedLogParser runs 'git log' for each file.
+
+    it is cheaper than LogParser for a few files, especially when
+    the repository has commit-graph with changed-path Bloom filters.
+    """
+
+    # --author-date-order is not given to last commit queries. it sorts whole history before
+    # the first commit is shown, while '-1' stops at the first commit changing the file.
+    log_format = ["log", "--pretty=format:%h %ad", "--date=raw"]
+    merge_args = {"combined": [], "first-parent": ["--first-parent"], "skip": ["--no-merges"]}
+
+    def __init__(self, files_parser, date_option = None, last_only = False, jobs = 1, merges = "combined",
+            revision = None):
+        self.files_parser = files_parser
+        self.date_option = date_option if date_option else "local"
+        self.last_only = last_only
+        self.jobs = jobs
+        self.merges = merges
+
+        check_date_option(self.date_option)
+        self.log_args = self.log_format + self.merge_args[merges]
+        if revision:
+            self.log_args.append(revision)
+
+        self.__first_commit_hash = {}
+        self.__last_commit_hash = {}
+
+        self.__parse_logs()
+
+    def __parse_logs(self):
+        pool = ThreadPool(self.jobs)
+        try:
+            results = pool.map(self.__query, self.files_parser.files)
+        finally:
+            pool.close()
+            pool.join()
+
+        for full, (fc, lc) in zip(self.files_parser.files_full, results):
+            if fc:
+                self.__first_commit_hash[full] = fc
+            if lc:
+                self.__last_commit_hash[full] = lc
+
+    def __query(self, file):
+        last_log = git(self.log_args + ["-1", "--", ":(literal)" + file], cwd=self.files_parser.cwd)
+        lc = self.__parse_one_commit(last_log) if last_log else None
+        if self.last_only or not lc:
+            return None, lc
+
+        # oldest commit that added the file.
+        first_log = git(self.log_args + ["--author-date-order", "--diff-filter=A", "--", ":(literal)" + file],
+                cwd=self.files_parser.cwd).rstrip("\n")
+        fc = self.__parse_one_commit(first_log.split("\n")[-1]) if first_log else lc
+        return fc, lc
+
+    def __parse_one_commit(self, one_commit):
+        hash, timestamp, tz = one_commit.rstrip("\n").split(" ")
+        return Commit(int(timestamp), intern_string(tz), hash, self.date_option)
+
+    def get_first_commit_contains(self, file):
+        """return commit that file are added first.
+        Arg : filename
+        Return : commit object. if file has no commit or parser is last_only, return None.
+        """
+
+        return self.__first_commit_hash.get(self.files_parser.get_full(file))
+
+    def get_last_commit_contains(self, file):
+        """return commit that file are changed last.
+        Arg : filename
+        Return : commit object. if file has no commit, return None.
+        """
+
+        return self.__last_commit_hash.get(self.files_parser.get_full(file))
+
+# rough costs in microseconds.
+process_cost = 2000.0
+commit_walk_cost = 5.0
+bloom_speedup = 10.0
+targeted_max_files = 64
+
+def read_commit_graph(cwd = None):
+    """read commit-graph files of the repository without running git.
+    Arg : directory in the repository. default is the current directory.
+    Return : (number of commits in commit-graph, whether it has changed-path Bloom filters)
+    """
+
+    info = os.path.join(find_repository(cwd)[1], "objects", "info")
+    graphs = [os.path.join(info, "commit-graph")]
+
+    chain = os.path.join(info, "commit-graphs", "commit-graph-chain")
+    if os.path.exists(chain):
+        with open(chain) as f:
+            graphs += [os.path.join(info, "commit-graphs", "graph-%s.graph" % l.strip()) for l in f if l.strip()]
+
+    commits_count = 0
+    has_bloom = False
+
+    for graph in graphs:
+        try:
+            with open(graph, "rb") as f:
+                header = f.read(8)
+                if len(header) < 8 or header[:4] != b"CGPH":
+                    continue
+                # chunk lookup table follows header. each entry is 4 byte id and 8 byte offset.
+                table = f.read((bytearray(header)[6] + 1) * 12)
+                chunks = dict((table[i:i + 4], struct.unpack(">Q", table[i + 4:i + 12])[0])
+                        for i in range(0, len(table), 12))
+
+                # the last entry of OID fanout is the number of commits.
+                if b"OIDF" in chunks:
+                    f.seek(chunks[b"OIDF"] + 255 * 4)
+                    commits_count += struct.unpack(">I", f.read(4))[0]
+        except (IOError, struct.error):
+            continue
+
+        if b"BIDX" in chunks and b"BDAT" in chunks:
+            has_bloom = True
+
+    return commits_count, has_bloom
+
+def has_bloom_filters(cwd = None):
+    """return True if commit-graph of the repository has changed-path Bloom filters."""
+
+    return read_commit_graph(cwd)[1]
+
+def plan_strategy(files_parser, last_only = False, jobs = 1, revision = None):
+    """choose 'scan' or 'targeted' by estimated cost.
+    Arg : FilesParser object, whether only last commits are needed, number of jobs, revision to walk from.
+            default is HEAD.
+    Return : strategy name
+    """
+
+    files_count = len(files_parser.files)
+    if files_count > targeted_max_files:
+        return "scan"
+    if files_count == 0:
+        return "targeted"
+
+    # a query walks history until it finds the file, and whole history for the first commit.
+    # each query is charged a whole walk, since the file may not be changed for long.
+    rounds = float(files_count) / jobs * (1 if last_only else 2)
+
+    commits_count, has_bloom = read_commit_graph(files_parser.cwd)
+    if not has_bloom:
+        # queries walk as slowly as a scan, whatever the size of history is.
+        # it is not counted then, since counting runs one more git.
+        return "targeted" if rounds <= 1 else "scan"
+
+    if revision or not commits_count:
+        # commit-graph has every commit, not only history of the revision.
+        commits_count = int(git(["rev-list", "--count", revision or "HEAD", "--"], cwd=files_parser.cwd))
+
+    targeted_cost = rounds * (process_cost + commits_count * commit_walk_cost / bloom_speedup)
+    scan_cost = process_cost + commits_count * commit_walk_cost
+
+    return "targeted" if targeted_cost < scan_cost else "scan"
+
+#=======================================
+# cache
+#=======================================
+
+class LogCache(object):
+    """LogCache keeps first and last commit of every file in the repository.
+
+    cache is stored in .git/ls-date-cache with the HEAD it was computed at.
+    if HEAD moved forward, only new commits are walked and merged.
+    otherwise (rebase, reset, ...) whole history is walked again.
+    if persistent is False, cache is kept only in memory.
+    follow_renames and merges are passed to LogParser. cache built with
+    other values of them is walked again.
+    cwd is a directory in the repository. default is the current directory.
+    if index_file is given, cache starts from the file written by export_index().
+    """
+
+    cache_name = "ls-date-cache"
+    cache_version = 2
+
+    # exported file is magic, version, sha256 of body and zlib compressed JSON body.
+    index_file_magic = b"git-ls-date-index\n"
+    index_file_version = 1
+
+    def __init__(self, files_parser, date_option = None, jobs = 1, persistent = True, follow_renames = False,
+            merges = "combined", cwd = None, index_file = None):
+        self.files_parser = files_parser
+        self.cwd = cwd
+        self.date_option = date_option if date_option else "local"
+        self.jobs = jobs
+        self.persistent = persistent
+        self.follow_renames = follow_renames
+        self.merges = merges
+        self.mode = {"follow_renames": follow_renames, "merges": merges}
+
+        check_date_option(self.date_option)
+
+        self.path = os.path.join(find_repository(cwd)[0], self.cache_name)
+        self.head = None
+        self.__commits = {}
+
+        if index_file:
+            self.__import_index(index_file)
+        elif self.persistent:
+            self.__load()
+        self.update()
+
+    def export_index(self, path):
+        """write commits and HEAD to a compressed and checksummed file atomically.
+        the file can be given to another clone of the repository as index_file.
+        Arg : path of the file
+        """
+
+        body = zlib.compress(json.dumps({"head": self.head, "mode": self.mode, "files": self.__commits}).encode())
+        header = self.index_file_magic + struct.pack(">I", self.index_file_version) + hashlib.sha256(body).digest()
+
+        tmp_path = "%s.%d" % (path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(header + body)
+        os.rename(tmp_path, path)
+
+    def __import_index(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except IOError as e:
+            raise GitCommandErrorException("--import-index", "cannot read %s: %s\n" % (path, e))
+
+        magic_length = len(self.index_file_magic)
+        header_length = magic_length + 4 + 32
+        if data[:magic_length] != self.index_file_magic or len(data) < header_length:
+            raise GitCommandErrorException("--import-index", "%s is not an index file.\n" % path)
+
+        version = struct.unpack(">I", data[magic_length:magic_length + 4])[0]
+        if version != self.index_file_version:
+            raise GitCommandErrorException("--import-index", "%s has unsupported version %d.\n" % (path, version))
+
+        body = data[header_length:]
+        if hashlib.sha256(body).digest() != data[magic_length + 4:header_length]:
+            raise GitCommandErrorException("--import-index", "%s is corrupted. checksum mismatch.\n" % path)
+
+        content = json.loads(zlib.decompress(body).decode())
+        if content["mode"] != self.mode:
+            raise GitCommandErrorException("--import-index",
+                    "%s was built with other --follow-renames or --merges.\n" % path)
+
+        # update() walks only commits after the imported HEAD, if it is an ancestor of HEAD.
+        self.head = content["head"]
+        self.__commits = content["files"]
+
+    def for_files(self, files_parser, date_option = None):
+        """return LogCache sharing commits with this one, which looks up files of files_parser.
+        Arg : FilesParser object, date option of returned commits
+        Return : LogCache object
+        """
+
+        cache = copy.copy(self)
+        cache.files_parser = files_parser
+        if date_option:
+            check_date_option(date_option)
+            cache.date_option = date_option
+        return cache
+
+    def __load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        if data.get("version") != self.cache_version:
+            return
+        if data.get("mode") != self.mode:
+            return
+
+        self.head = data["head"]
+        self.__commits = data["files"]
+
+    def __save(self):
+        data = {"version": self.cache_version, "head": self.head, "mode": self.mode, "files": self.__commits}
+
+        tmp_path = "%s.%d" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.rename(tmp_path, self.path)
+
+    def update(self):
+        """walk commits added since the cached HEAD and merge them."""
+
+        head = read_head(self.cwd)
+        if head == self.head:
+            return
+
+        revision = None
+        if self.head and self.__is_ancestor(self.head, head):
+            revision = self.head + ".." + head
+        else:
+            self.__commits = {}
+
+        tree_parser = FilesParser(":/", self.cwd)
+        parser = LogParser(tree_parser, self.date_option, revision = revision, compact = True, jobs = self.jobs,
+                follow_renames = self.follow_renames, merges = self.merges)
+
+        commits = {}
+        for full in tree_parser.files_full:
+            # file renamed in new commits is cached under its old path.
+            cached = self.__commits.get(parser.get_origin_path(full))
+            fc = parser.get_first_commit_contains(full)
+            lc = parser.get_last_commit_contains(full)
+
+            if cached and lc:
+                commits[full] = self.__merge_commits(cached, fc, lc)
+            elif cached:
+                commits[full] = cached
+            elif fc:
+                commits[full] = [fc.timestamp, fc.tz, fc.hash, lc.timestamp, lc.tz, lc.hash]
+
+        self.__commits = commits
+        self.head = head
+        if self.persistent:
+            self.__save()
+
+    def __merge_commits(self, cached, fc, lc):
+        # new commits are not always newer. merged branches can have older dates,
+        # so the oldest first commit and the newest last commit are kept, as a whole walk finds.
+        commits = list(cached)
+        if fc.timestamp < commits[0]:
+            commits[0:3] = [fc.timestamp, fc.tz, fc.hash]
+        if lc.timestamp >= commits[3]:
+            commits[3:6] = [lc.timestamp, lc.tz, lc.hash]
+        return commits
+
+    def __is_ancestor(self, ancestor, commit):
+        try:
+            return git(["merge-base", ancestor, commit], cwd=self.cwd).strip() == ancestor
+        except GitCommandErrorException:
+            return False
+
+    def get_first_commit_contains(self, file):
+        """return commit that file are added first.
+        Arg : filename
+        Return : commit object. if file has no commit, return None.
+        """
+
+        cached = self.__commits.get(self.files_parser.get_full(file))
+        return Commit(cached[0], cached[1], cached[2], self.date_option) if cached else None
+
+    def get_last_commit_contains(self, file):
+        """return commit that file are changed last.
+        Arg : filename
+        Return : commit object. if file has no commit, return None.
+        """
+
+        cached = self.__commits.get(self.files_parser.get_full(file))
+        return Commit(cached[3], cached[4], cached[5], self.date_option) if cached else None
+
+class LogIndex(object):
+    """LogIndex keeps first and last commit of every file in a binary index,
+    which is read through mmap and searched by binary search without loading it.
+
+    index is stored in .git/ls-date-index with the HEAD it was computed at,
+    and it is rebuilt by LogParser when HEAD or follow_renames and merges changed.
+
+    format (big endian):
+      header  : magic, version, number of files, mode, length of HEAD, HEAD
+      records : sorted by path. offset and length of path in path table, then
+                timestamp, timezone, length of hash and hash bytes of first and last commits
+      paths   : utf-8 paths
+    """
+
+    index_name = "ls-date-index"
+    index_magic = b"LSDI"
+    index_version = 1
+    header_format = ">4sIIBB64s"
+    record_format = ">IIq5sB32sq5sB32s"
+
+    def __init__(self, files_parser, date_option = None, jobs = 1, follow_renames = False, merges = "combined",
+            cwd = None):
+        self.files_parser = files_parser
+        self.date_option = date_option if date_option else "local"
+        self.jobs = jobs
+        self.follow_renames = follow_renames
+        self.merges = merges
+        self.cwd = cwd
+
+        check_date_option(self.date_option)
+
+        self.path = os.path.join(find_repository(cwd)[0], self.index_name)
+        self.mode = int(follow_renames) | Configuration.merge_policies.index(merges) << 1
+        self.header_size = struct.calcsize(self.header_format)
+        self.record_size = struct.calcsize(self.record_format)
+
+        self.head = None
+        self.count = 0
+        self.__map = None
+
+        head = read_head(cwd)
+        if not self.__open() or self.head != head:
+            self.build(head)
+            self.__open()
+
+    def for_files(self, files_parser, date_option = None):
+        """return LogIndex sharing the mapped index, which looks up files of files_parser.
+        Arg : FilesParser object, date option of returned commits
+        Return : LogIndex object
+        """
+
+        index = copy.copy(self)
+        index.files_parser = files_parser
+        if date_option:
+            check_date_option(date_option)
+            index.date_option = date_option
+        return index
+
+    def find_files(self, pathes):
+        """return FilesParser of pathes without running git, if all of them are files in the index.
+        files are named and ordered as 'git ls-files' lists them.
+        Arg : paths relative to the current directory
+        Return : FilesParser object or None
+        """
+
+        prefix = get_prefix(self.cwd)
+        files_full = set()
+        for path in pathes:
+            # pathspec magic and wildcards are left to 'git ls-files'.
+            if not path or path.startswith(":") or any(c in path for c in "*?[\\"):
+                return None
+            full = posixpath.normpath(posixpath.join(prefix, path.replace(os.sep, "/")))
+            if full.startswith("../") or not self.lookup(full):
+                return None
+            files_full.add(full)
+
+        if not files_full:
+            return None
+        files_full = sorted(files_full)
+        return FilesParser.from_files([relative_path(full, prefix) for full in files_full], files_full, self.cwd)
+
+    def __open(self):
+        try:
+            with open(self.path, "rb") as f:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return False
+
+        try:
+            magic, version, count, mode, head_length, head = struct.unpack_from(self.header_format, self.__map)
+        except struct.error:
+            return False
+        if magic != self.index_magic or version != self.index_version or mode != self.mode:
+            return False
+
+        self.count = count
+        self.head = head[:head_length].decode()
+        self.paths_offset = self.header_size + count * self.record_size
+        return True
+
+    def build(self, head):
+        """walk whole history and write index atomically.
+        Arg : commit id of HEAD
+        """
+
+        tree_parser = FilesParser(":/", self.cwd)
+        parser = LogParser(tree_parser, self.date_option, compact = True, jobs = self.jobs,
+                follow_renames = self.follow_renames, merges = self.merges)
+
+        entries = []
+        for full in tree_parser.files_full:
+            lc = parser.get_last_commit_contains(full)
+            if lc:
+                entries.append((full.encode("utf-8"), parser.get_first_commit_contains(full), lc))
+        entries.sort(key=lambda entry: entry[0])
+
+        records = []
+        paths = []
+        offset = 0
+        for path, fc, lc in entries:
+            records.append(struct.pack(self.record_format, offset, len(path),
+                fc.timestamp, fc.tz.encode(), len(fc.hash), self.__pack_hash(fc.hash),
+                lc.timestamp, lc.tz.encode(), len(lc.hash), self.__pack_hash(lc.hash)))
+            paths.append(path)
+            offset += len(path)
+
+        header = struct.pack(self.header_format, self.index_magic, self.index_version, len(entries), self.mode,
+                len(head), head.encode())
+
+        tmp_path = "%s.%d" % (self.path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(header + b"".join(records) + b"".join(paths))
+        os.rename(tmp_path, self.path)
+
+    def __pack_hash(self, hash):
+        # odd length abbreviated hash is padded. its length is kept in record.
+        return binascii.unhexlify(hash + "0" * (len(hash) % 2))
+
+    def lookup(self, full):
+        """find record of file by binary search.
+        Arg : full path
+        Return : (first commit, last commit). if file is not in index, return None.
+        """
+
+        target = full.encode("utf-8")
+        mapped = self.__map
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.header_size + middle * self.record_size
+            path_offset, path_length = struct.unpack_from(">II", mapped, offset)
+            start = self.paths_offset + path_offset
+            path = mapped[start:start + path_length]
+
+            if path < target:
+                low = middle + 1
+            elif path > target:
+                high = middle
+            else:
+                record = struct.unpack_from(self.record_format, mapped, offset)
+                return self.__commit(*record[2:6]), self.__commit(*record[6:10])
+
+        return None
+
+    def __commit(self, timestamp, tz, hash_length, hash):
+        return Commit(timestamp, intern_string(tz.decode()), binascii.hexlify(hash).decode()[:hash_length], self.date_option)
+
+    def get_first_commit_contains(self, file):
+        """return commit that file are added first.
+        Arg : filename
+        Return : commit object. if file has no commit, return None.
+        """
+
+        commits = self.lookup(self.files_parser.get_full(file) or file)
+        return commits[0] if commits else None
+
+    def get_last_commit_contains(self, file):
+        """return commit that file are changed last.
+        Arg : filename
+        Return : commit object. if file has no commit, return None.
+        """
+
+        commits = self.lookup(self.files_parser.get_full(file) or file)
+        return commits[1] if commits else None
+
+#=======================================
+# server
+#=======================================
+
+socket_name = "ls-date.sock"
+
+def recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+class Server(object):
+    """Server keeps LogCache of the repository in memory and answers
+    queries from 'git ls-date --connect' over a unix socket.
+
+    cache is updated when HEAD or refs move.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.git_dir, self.common_dir, _ = find_repository()
+        self.path = os.path.join(self.git_dir, socket_name)
+
+        self.__cache = None
+        self.__refs_signature = None
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            if connect_socket(self.path):
+                raise GitCommandErrorException("--serve", "git-ls-date server is already running.")
+            os.remove(self.path)
+
+        # remove the socket on kill too.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            listener.listen(16)
+
+            while True:
+                conn, _ = listener.accept()
+                try:
+                    self.__handle(conn)
+                finally:
+                    conn.close()
+        finally:
+            listener.close()
+            os.remove(self.path)
+
+    def __handle(self, conn):
+        try:
+            request = json.loads(recv_all(conn).decode())
+        except (ValueError, socket.error):
+            # connection to check whether server is running.
+            return
+
+        try:
+            status, output = self.query(request["cwd"], request["args"])
+        except Exception as e:
+            # an error of one request does not stop the server.
+            status, output = 1, "error: %s: %s\n" % (e.__class__.__name__, e)
+        conn.sendall(json.dumps({"status": status, "output": output}).encode())
+
+    def query(self, cwd, args):
+        """run git-ls-date in cwd with args using the kept caches.
+        Arg : working directory, commandline arguments
+        Return : exit status and output string
+        """
+
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        original_cwd = os.getcwd()
+
+        status = 0
+        try:
+            os.chdir(cwd)
+
+            config = copy.copy(self.config)
+            # lists are extended by options.
+            config.repos, config.revs = list(self.config.repos), list(self.config.revs)
+            config.argparse(args)
+
+            if len(config.revs) > 1:
+                show_revisions(config, sys.stdout)
+            elif ((config.follow_renames, config.merges) != (self.config.follow_renames, self.config.merges) or
+                    not uses_head_history(config)):
+                # kept cache is for the other mode, or it has only whole history of HEAD.
+                files_parser = FilesParser(config.pathes, revision = config.revision)
+                show(config, files_parser, create_parser(config, files_parser))
+            else:
+                files_parser = FilesParser(config.pathes)
+                show(config, files_parser, self.__get_parser(config, files_parser))
+        except SystemExit as e:
+            status = e.code or 0
+        except GitCommandErrorException as e:
+            print(e)
+            status = 1
+        finally:
+            sys.stdout = stdout
+            os.chdir(original_cwd)
+
+        return status, output.getvalue()
+
+    def __get_parser(self, config, files_parser):
+        refs_signature = self.__read_refs_signature()
+        if self.__cache and refs_signature != self.__refs_signature:
+            self.__cache.update()
+        self.__refs_signature = refs_signature
+
+        if not self.__cache:
+            self.__cache = LogCache(None, None, self.config.jobs, self.config.cache, self.config.follow_renames,
+                    self.config.merges)
+
+        return self.__cache.for_files(files_parser, config.date)
+
+    def __read_refs_signature(self):
+        head_path = os.path.join(self.git_dir, "HEAD")
+        with open(head_path) as f:
+            head = f.read().strip()
+
+        paths = [head_path, os.path.join(self.common_dir, "packed-refs")]
+        if head.startswith("ref: "):
+            paths.append(os.path.join(self.common_dir, head[5:]))
+
+        return [head] + [os.stat(p).st_mtime if os.path.exists(p) else None for p in paths]
+
+def connect_socket(path):
+    """return connected socket. if nobody listens path, return None."""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+def find_socket_path():
+    """return socket path of the repository without running git. if not found, return None."""
+
+    repository = _find_repository(os.getcwd())
+    return os.path.join(repository[0], socket_name) if repository else None
+
+def lists_repositories(args):
+    """return True if args list repositories other than the current one."""
+
+    try:
+        opts, _ = getopt.getopt(args, Configuration.shortopts, Configuration.longopts)
+    except getopt.GetoptError:
+        return False
+    return any(opt in ["--repo", "--repos-from", "--recurse-submodules"] for opt, _ in opts)
+
+def connect(args):
+    """send args to the running server and print its output.
+    the server keeps commits of its repository only, so other repositories are not asked.
+    Arg : commandline arguments
+    Return : exit status. if server is not running or args list repositories, return None.
+    """
+
+    if lists_repositories(args):
+        return None
+
+    path = find_socket_path()
+    sock = connect_socket(path) if path else None
+    if not sock:
+        return None
+
+    try:
+        sock.sendall(json.dumps({"cwd": os.getcwd(), "args": args}).encode())
+        sock.shutdown(socket.SHUT_WR)
+        response = json.loads(recv_all(sock).decode())
+    finally:
+        sock.close()
+
+    sys.stdout.write(response["output"])
+    return response["status"]
+
+#=======================================
+# api
+#=======================================
+
+# placeholders a Record answers. f is path, ld and lh are last, fd and fh are first.
+record_fields = ["f", "ld", "lh", "fd", "fh"]
+
+class Record(object):
+    """Record is a file and its commits yielded by ls_date().
+
+    path is relative to the repo directory and full_path is relative to top-level.
+    first and last are Commit objects. they are None if the file has no commit
+    or they were not requested.
+    """
+
+    __slots__ = ["path", "full_path", "first", "last"]
+
+    def __init__(self, path, full_path, first, last):
+        self.path = path
+        self.full_path = full_path
+        self.first = first
+        self.last = last
+
+    def __repr__(self):
+        return "Record(%r, first=%r, last=%r)" % (self.path, self.first and self.first.hash,
+                self.last and self.last.hash)
+
+def ls_date(paths = [], repo = None, date = None, fields = None, cache = None, follow_renames = False,
+        merges = "combined"):
+    """list files with their first and last commits lazily, for use as a library.
+    Arg : paths : paths like command line arguments, relative to repo.
+          repo : directory in the repository. default is the current directory.
+          date : date option of commits.(default: short)
+          fields : placeholders which will be used, like ["ld", "f"]. default is all.
+                first commits are walked only if "fd" or "fh" is in fields.
+          cache : LogCache object to reuse. it is updated if HEAD moved, and its
+                follow_renames and merges are used instead of arguments.
+          follow_renames, merges : same as command line options.
+    Return : generator yielding Record objects.
+            if first commits are walked, records are yielded in order of files after the walk.
+            otherwise each record is yielded as soon as its last commit is found,
+            and files without commit come last.
+    Raise : GitCommandErrorException, ValueError for unknown field or merge policy
+    """
+
+    date = date if date else Configuration.date_default
+    check_date_option(date)
+
+    fields = set(fields) if fields is not None else set(record_fields)
+    unknown = fields.difference(record_fields)
+    if unknown:
+        raise ValueError("unknown fields: %s" % ", ".join(sorted(unknown)))
+    if merges not in Configuration.merge_policies:
+        raise ValueError("unknown merge policy: %s" % merges)
+
+    return _iter_records(paths, repo, date, bool(fields & set(["fd", "fh"])), cache, follow_renames, merges)
+
+def _iter_records(paths, repo, date, needs_first, cache, follow_renames, merges):
+    files_parser = FilesParser(paths, repo)
+
+    if cache:
+        cache.update()
+        parser = cache.for_files(files_parser, date)
+        for f, full in zip(files_parser.files, files_parser.files_full):
+            yield Record(f, full, parser.get_first_commit_contains(f) if needs_first else None,
+                    parser.get_last_commit_contains(f))
+        return
+
+    parser = LogParser(files_parser, date, last_only = not needs_first, compact = True,
+            follow_renames = follow_renames, merges = merges, lazy = True)
+
+    if needs_first:
+        for _ in parser.iter_resolved():
+            pass
+        for f, full in zip(files_parser.files, files_parser.files_full):
+            yield Record(f, full, parser.get_first_commit_contains(f), parser.get_last_commit_contains(f))
+        return
+
+    for full in parser.iter_resolved():
+        f = files_parser.get_abbrev(full)
+        yield Record(f, full, None, parser.get_last_commit_contains(f))
+
+    for f, full in zip(files_parser.files, files_parser.files_full):
+        if not parser.get_last_commit_contains(f):
+            yield Record(f, full, None, None)
+
 #=======================================
 # main
 #=======================================
 
+def window_args(config):
+    """return 'git log' options limiting walked commits to config.since, config.until and config.max_commits."""
+
+    args = []
+    if config.since:
+        args.append("--since=" + config.since)
+    if config.until:
+        args.append("--until=" + config.until)
+    if config.max_commits:
+        args.append("--max-count=%d" % config.max_commits)
+    return args
+
+def uses_head_history(config):
+    """return True if whole history of HEAD answers config, so LogCache and LogIndex can be used.
+    they keep only first and last commits of HEAD.
+    """
+
+    return not (needs_statistics(config.format) or config.revision or window_args(config))
+
+def create_parser(config, files_parser):
+    """return parser which answers first and last commits of files.
+    Arg : Configuration object, FilesParser object
+    Return : LogParser, TargetedLogParser, LogCache or RevisionLog object
+    """
+
+    fields = format_fields(config.format) | set([config.sort])
+    if not fields & set(commit_fields):
+        # no history is read. empty log answers no commit for every file.
+        return RevisionLog(files_parser)
+
+    window = window_args(config)
+
+    # first commits are needed only if format or sort uses them.
+    # commits are counted only if whole history is walked.
+    last_only = not fields & set(["fd", "fh", "fa", "n", "na", "st"])
+
+    if (config.cache or config.import_index) and uses_head_history(config):
+        return LogCache(files_parser, config.date, config.jobs, config.cache, config.follow_renames, config.merges,
+                files_parser.cwd, config.import_index)
+
+    # queries can not follow renames, limit history nor gather statistics.
+    # strategy is planned only if it can be targeted.
+    strategy = config.strategy
+    if config.follow_renames or window or fields & set(statistics_fields):
+        strategy = "scan"
+    elif strategy == "auto":
+        strategy = plan_strategy(files_parser, last_only, config.jobs, config.revision)
+
+    if strategy == "targeted":
+        return TargetedLogParser(files_parser, config.date, last_only, config.jobs, config.merges, config.revision)
+    else:
+        # statistics are gathered in one walk with endpoints.
+        return LogParser(files_parser, config.date, last_only, config.revision, compact = True, jobs = config.jobs,
+                follow_renames = config.follow_renames, merges = config.merges,
+                authors = bool(fields & set(["la", "fa", "na"])), window = window)
+
+def roll_up(files, depth = -1):
+    """aggregate files into every directory above them.
+    a directory has the oldest first commit, the newest last commit, the number of files under it,
+    the sum of their commit counts and all of their authors.
+    Arg : list of (filename, first commit, last commit, number of files, number of commits, authors),
+            depth of directories. deeper ones are merged into their parent. -1 is unlimited.
+    Return : list of (directory, first commit, last commit, number of files, number of commits, authors)
+            in order of directory. the first one is "." which has all files.
+    """
+
+    directories = {}
+    for f, fc, lc, count, commits, authors in files:
+        parts = f.split("/")[:-1]
+        if depth >= 0:
+            parts = parts[:depth]
+
+        directory = "."
+        for i in range(len(parts) + 1):
+            if i:
+                directory = parts[0] if i == 1 else directory + "/" + parts[i - 1]
+
+            entry = directories.get(directory)
+            if entry is None:
+                directories[directory] = [fc, lc, count, commits, set(authors) if authors is not None else None]
+                continue
+
+            if fc.timestamp is not None and (entry[0].timestamp is None or fc.timestamp < entry[0].timestamp):
+                entry[0] = fc
+            if lc.timestamp is not None and (entry[1].timestamp is None or lc.timestamp > entry[1].timestamp):
+                entry[1] = lc
+            entry[2] += count
+            if commits is not None:
+                entry[3] += commits
+            if authors is not None:
+                entry[4] |= authors
+
+    return [(d,) + tuple(entry) for d, entry in sorted(directories.items())]
+
+def open_index(config, cwd = None):
+    """open LogIndex and find files in it.
+    if some of config.pathes is not a file in the index, files are listed by git.
+    Arg : Configuration object, directory in the repository
+    Return : FilesParser object, LogIndex object
+    """
+
+    index = LogIndex(None, config.date, config.jobs, config.follow_renames, config.merges, cwd)
+    files_parser = index.find_files(config.pathes) or FilesParser(config.pathes, cwd)
+    profile.lap("files")
+    return files_parser, index.for_files(files_parser)
+
+def select_files(config, files_parser, parser):
+    """return files to show in order of config.sort and config.limit.
+    only selected files are sorted fully, since heap is used for limit.
+    files without commit always come last.
+    with config.tree, directories are returned instead of files.
+    Arg : Configuration object, FilesParser object, parser
+    Return : list of (filename, first commit, last commit, number of files, number of commits, authors).
+            number of commits and authors are None unless format uses them.
+    """
+
+    fields = format_fields(config.format)
+    count_commits = "n" in fields
+    count_authors = "na" in fields
+
+    files = []
+    for f in files_parser.files:
+        fc = parser.get_first_commit_contains(f) or no_commit
+        lc = parser.get_last_commit_contains(f) or no_commit
+        files.append((f, fc, lc, 1, parser.get_commit_count_contains(f) if count_commits else None,
+                parser.get_authors_contains(f) if count_authors else None))
+
+    if config.tree is not None:
+        files = roll_up(files, config.tree)
+
+    if not config.sort:
+        return files[:config.limit] if config.limit is not None else files
+
+    if config.sort == "f":
+        key = lambda info: info[0]
+        committed, uncommitted = files, []
+    else:
+        index = 1 if config.sort == "fd" else 2
+        key = lambda info: info[index].timestamp
+        committed = [info for info in files if info[index].timestamp is not None]
+        uncommitted = [info for info in files if info[index].timestamp is None]
+
+    if config.limit is None:
+        return sorted(committed, key=key, reverse=config.reverse) + uncommitted
+
+    select = heapq.nlargest if config.reverse else heapq.nsmallest
+    return (select(config.limit, committed, key=key) + uncommitted)[:config.limit]
+
+class RowFormatter(object):
+    """RowFormatter compiles show-format once and writes rows in output style.
+    values of placeholders which format does not use are never computed.
+    """
+
+    buffer_rows = 4096
+
+    def __init__(self, format, output = "text", tree = False, repo = ".", revision = "HEAD", shallow = ()):
+        self.output = output
+        self.tree = tree
+        self.repo = repo
+        self.revision = revision
+        self.shallow = shallow
+
+        # abbreviated hash to whether it is a shallow boundary.
+        self.__boundaries = {}
+
+        self.keys = []
+        self.getters = []
+        template = []
+
+        for literal, field, spec, conversion in string.Formatter().parse(format):
+            template.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+
+            # field like 'f[0]' keeps its index or attribute.
+            name = re.match(r"[^.\[]*", field).group(0)
+            spec = spec or ""
+            key = name
+
+            date_option, _, rest = spec.partition(":")
+            if name in ["ld", "fd"] and parse_date_option(date_option):
+                spec = rest
+                key = "%s:%s" % (name, date_option)
+            else:
+                date_option = None
+
+            self.keys.append(key)
+            self.getters.append(self.__getter(name, date_option))
+            template.append("{%d%s%s%s}" % (len(self.getters) - 1, field[len(name):],
+                "!" + conversion if conversion else "", ":" + spec if spec else ""))
+
+        self.template = "".join(template)
+
+    def __getter(self, name, date_option):
+        index = 1 if name[0] == "f" else 2
+
+        if name == "f":
+            return lambda row: row[0]
+        elif name == "d":
+            if self.tree:
+                return lambda row: row[0]
+            return lambda row: posixpath.dirname(row[0]) or "."
+        elif name == "nf":
+            return lambda row: row[3]
+        elif name == "n":
+            return lambda row: row[4]
+        elif name == "na":
+            return lambda row: len(row[5])
+        elif name in ["la", "fa"]:
+            return lambda row: row[index].author or ""
+        elif name == "r":
+            return lambda row: self.repo
+        elif name == "rv":
+            return lambda row: self.revision
+        elif name == "st":
+            return self.status
+        elif name in ["lh", "fh"]:
+            return lambda row: row[index].hash
+        elif name in ["ld", "fd"]:
+            if date_option:
+                return lambda row: format_date(row[index].timestamp, row[index].tz, date_option)
+            return lambda row: row[index].date
+
+        raise KeyError(name)
+
+    def status(self, row):
+        """return value of {st} placeholder of row."""
+
+        if row[2].timestamp is None:
+            return "untouched"
+        if self.is_boundary(row[1]):
+            return "boundary"
+        return ""
+
+    def is_boundary(self, commit):
+        """return True if commit is a boundary of shallow clone."""
+
+        if not self.shallow or not commit.hash:
+            return False
+
+        boundary = self.__boundaries.get(commit.hash)
+        if boundary is None:
+            boundary = self.__boundaries[commit.hash] = any(full.startswith(commit.hash) for full in self.shallow)
+        return boundary
+
+    def write(self, rows, stream, header = True):
+        """write rows of select_files() to stream.
+        header is for csv.
+        """
+
+        getters = self.getters
+        template = self.template
+
+        if self.output == "jsonl":
+            keys = self.keys
+            lines = (json.dumps(dict(zip(keys, [g(row) for g in getters]))) + "\n" for row in rows)
+        elif self.output == "csv":
+            writer = csv.writer(stream, lineterminator="\n")
+            if header:
+                writer.writerow(self.keys)
+            buffer = []
+            for row in rows:
+                buffer.append([g(row) for g in getters])
+                if len(buffer) >= self.buffer_rows:
+                    writer.writerows(buffer)
+                    buffer = []
+            writer.writerows(buffer)
+            return
+        else:
+            end = "\0" if self.output == "z" else "\n"
+            lines = (template.format(*[g(row) for g in getters]) + end for row in rows)
+
+        buffer = []
+        for line in lines:
+            buffer.append(line)
+            if len(buffer) >= self.buffer_rows:
+                stream.write("".join(buffer))
+                buffer = []
+        stream.write("".join(buffer))
+
+def show(config, files_parser, parser):
+    """print files with their first and last commits."""
+
+    formatter = RowFormatter(config.format, config.output, config.tree is not None, ".", config.revision or "HEAD",
+            read_shallow())
+    files = select_files(config, files_parser, parser)
+    formatter.write(files, sys.stdout)
+
+    if formatter.shallow and "st" not in formatter.keys and format_fields(config.format) & set(["fd", "fh", "fa"]):
+        boundaries = len([info for info in files if formatter.is_boundary(info[1])])
+        if boundaries:
+            sys.stderr.write("warning: first commits of %d files are the boundary of shallow clone. "
+                    "they can be older. see {st} placeholder.\n" % boundaries)
+
+def show_revisions(config, stream, repo = None, header = True):
+    """write files with their first and last commits as of every revision in config.revs,
+    which are found in one history walk.
+    Arg : Configuration object, stream, path of repository, whether to write csv header
+    Raise : GitCommandErrorException
+    """
+
+    fields = format_fields(config.format) | set([config.sort])
+    parser = RevisionsLogParser(config.revs, config.pathes, config.date, config.merges,
+            bool(fields & set(["la", "fa", "na"])), repo, window_args(config))
+    profile.lap("log")
+
+    shallow = read_shallow(repo)
+    for i, revision in enumerate(config.revs):
+        files_parser, log = parser.for_revision(i)
+        formatter = RowFormatter(config.format, config.output, config.tree is not None, repo or ".", revision,
+                shallow)
+        formatter.write(select_files(config, files_parser, log), stream, header and i == 0)
+
+def list_submodules(repo):
+    """return paths of checked out submodules in repo recursively.
+    Arg : path of repository
+    Return : list of paths joined to repo
+    """
+
+    submodules = []
+    for entry in git("ls-files -z --stage", cwd=repo).split("\0")[:-1]:
+        info, _, path = entry.partition("\t")
+        if not info.startswith("160000 "):
+            continue
+
+        # submodules not checked out have no '.git'.
+        submodule = posixpath.join(repo, path) if repo != "." else path
+        if os.path.exists(os.path.join(submodule, ".git")):
+            submodules.append(submodule)
+            submodules.extend(list_submodules(submodule))
+    return submodules
+
+def run_repository(args):
+    """list files of one repository for run_repositories.
+    Arg : (Configuration object, path of repository, whether to write csv header)
+    Return : (output string, error message or None)
+    """
+
+    config, repo, header = args
+    try:
+        output = StringIO()
+        if len(config.revs) > 1:
+            show_revisions(config, output, repo, header)
+            return output.getvalue(), None
+
+        if config.index and uses_head_history(config):
+            files_parser, parser = open_index(config, repo)
+        else:
+            files_parser = FilesParser(config.pathes, repo, config.revision)
+            parser = create_parser(config, files_parser)
+
+        formatter = RowFormatter(config.format, config.output, config.tree is not None, repo,
+                config.revision or "HEAD", read_shallow(repo))
+        formatter.write(select_files(config, files_parser, parser), output, header)
+        return output.getvalue(), None
+    except (GitCommandErrorException, EnvironmentError) as e:
+        return "", str(e).strip()
+
+def run_repositories(config):
+    """list files of config.repos and their submodules at once by config.repo_jobs workers.
+    output is written in order of repositories as soon as it is ready.
+    Arg : Configuration object
+    Return : exit status. 1 if some repository failed.
+    """
+
+    repos = config.repos or ["."]
+    pool = ThreadPool(config.repo_jobs)
+    try:
+        if config.recurse_submodules:
+            def with_submodules(repo):
+                try:
+                    return [repo] + list_submodules(repo)
+                except (GitCommandErrorException, EnvironmentError):
+                    # error is reported by run_repository.
+                    return [repo]
+            repos = [r for found in pool.map(with_submodules, repos) for r in found]
+
+        status = 0
+        # csv header is written here, since any repository may fail.
+        RowFormatter(config.format, config.output).write([], sys.stdout)
+        args = [(config, repo, False) for repo in repos]
+        for repo, (output, error) in zip(repos, pool.imap(run_repository, args)):
+            sys.stdout.write(output)
+            if error:
+                sys.stdout.flush()
+                sys.stderr.write("error: %s: %s\n" % (repo, error))
+                status = 1
+        return status
+    finally:
+        pool.close()
+        pool.join()
+
 def main():
+    args = sys.argv[1:]
+
+    if "--connect" in args:
+        args = [arg for arg in args if arg != "--connect"]
+        status = connect(args)
+        if status is not None:
+            sys.exit(status)
+
+    if "--profile" in args or config_bool(os.environ.get("GIT_LS_DATE_PROFILE", "false")):
+        profile.start()
 
     try:
         config = Configuration()
-        config.argparse(sys.argv[1:])
-
-        files_parser = FilesParser(config.pathes)
-        parser = LogParser(files_parser, config.date)
+        config.argparse(args)
+        profile.lap("config")
+
+        if config.serve:
+            Server(config).serve_forever()
+            return
+
+        if config.repos or config.recurse_submodules:
+            sys.exit(run_repositories(config))
+
+        if config.export_index:
+            cache = LogCache(None, config.date, config.jobs, config.cache, config.follow_renames, config.merges,
+                    index_file = config.import_index)
+            cache.export_index(config.export_index)
+            profile.lap("log")
+            if profile.enabled:
+                profile.report()
+            return
+
+        if len(config.revs) > 1:
+            show_revisions(config, sys.stdout)
+            profile.lap("show")
+            if profile.enabled:
+                profile.report()
+            return
+
+        if config.index and uses_head_history(config):
+            files_parser, parser = open_index(config)
+        else:
+            files_parser = FilesParser(config.pathes, revision = config.revision)
+            profile.lap("files")
+            parser = create_parser(config, files_parser)
+        profile.lap("log")
     except GitCommandErrorException as e:
         print(e)
         sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
 
-    for f in files_parser.files:
-        fc = parser.get_first_commit_contains(f)
-        lc = parser.get_last_commit_contains(f)
-        formatted_info = config.format.format(fd=fc.date, fh=fc.hash, ld=lc.date, lh=lc.hash, f=f)
-        print(formatted_info)
+    show(config, files_parser, parser)
+    profile.lap("show")
+
+    if profile.enabled:
+        profile.report()
 
 if __name__ == "__main__":
     main()
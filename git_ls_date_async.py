@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""git_ls_date_async
+
+asyncio API of git-ls-date for event loops. it requires Python 3.5 or higher.
+
+git runs as asyncio subprocesses, so the event loop is not blocked.
+concurrent queries are coalesced into one history walk, and the number of
+git processes is limited by a semaphore.
+
+    lister = AsyncLsDate("/path/to/repo", date = "iso")
+    records = await lister.ls_date(["docs/index.rst"])
+"""
+
+import asyncio
+from asyncio.subprocess import PIPE
+
+import git_ls_date
+from git_ls_date import GitCommandErrorException, FilesParser, LogParser, Record
+
+#=======================================
+# git
+#=======================================
+
+async def git(cmd, input = None, cwd = None):
+    """run git command as asyncio subprocess.
+    Arg : command string or argument list. input is written to stdin.
+            cwd is directory to run git in. default is the current directory.
+    Return : return command output string
+    Raise : GitCommandErrorException
+    """
+
+    args = git_ls_date.git_args(cmd)
+    process = await asyncio.create_subprocess_exec("git", *args, stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=cwd)
+    stdout, stderr = await process.communicate(input.encode() if input else None)
+
+    if stderr:
+        raise GitCommandErrorException(" ".join(args), stderr.decode())
+
+    return stdout.decode()
+
+#=======================================
+# lister
+#=======================================
+
+class AsyncLsDate(object):
+    """AsyncLsDate answers queries of first and last commits on asyncio event loop.
+
+    files requested while a history walk is waiting to start are walked together,
+    and files being walked are not walked again. the walk waits for queries listing
+    their files at most coalesce_delay seconds.
+    commits are kept until HEAD moves.
+    """
+
+    def __init__(self, repo = None, date = None, max_processes = 4, coalesce_delay = 0.05, follow_renames = False,
+            merges = "combined"):
+        self.repo = repo
+        self.date_option = date if date else git_ls_date.Configuration.date_default
+        self.max_processes = max_processes
+        self.coalesce_delay = coalesce_delay
+        self.follow_renames = follow_renames
+        self.merges = merges
+
+        git_ls_date.check_date_option(self.date_option)
+        if merges not in git_ls_date.Configuration.merge_policies:
+            raise ValueError("unknown merge policy: %s" % merges)
+
+        # created on the event loop when they are used first.
+        self.__semaphore = None
+        self.__listed = None
+        self.__listing = 0
+
+        self.__head = None
+        self.__commits = {}
+        self.__walks = {}
+        self.__pending = None
+
+        self.walks_count = 0
+
+    async def ls_date(self, paths = []):
+        """return files with their first and last commits.
+        Arg : paths like command line arguments, relative to repo
+        Return : list of Record objects in order of files
+        Raise : GitCommandErrorException
+        """
+
+        self.__prepare()
+
+        self.__listing += 1
+        self.__listed.clear()
+        try:
+            output = await self.__git(FilesParser.ls_files_format + list(paths), cwd=self.repo)
+        finally:
+            self.__listing -= 1
+            if not self.__listing:
+                self.__listed.set()
+        files_parser = FilesParser.from_output(output, list(paths), self.repo)
+
+        head = git_ls_date.read_head(self.repo)
+        if head != self.__head:
+            self.__head = head
+            self.__commits = {}
+            # running walks are of the old HEAD. only the pending walk, which has not run git yet, is joined.
+            pending = self.__pending and self.__pending[1]
+            self.__walks = dict((full, walk) for full, walk in self.__walks.items() if walk is pending)
+
+        walks = set()
+        for full in files_parser.files_full:
+            if full not in self.__commits:
+                walks.add(self.__walks.get(full) or self.__schedule(full))
+
+        # commits of walks are given to their queries, even if HEAD moved and they are not kept.
+        walked = {}
+        if walks:
+            for commits in await asyncio.gather(*walks):
+                walked.update(commits)
+
+        records = []
+        for f, full in zip(files_parser.files, files_parser.files_full):
+            fc, lc = walked.get(full) or self.__commits.get(full, (None, None))
+            records.append(Record(f, full, fc, lc))
+        return records
+
+    def __prepare(self):
+        if not self.__semaphore:
+            self.__semaphore = asyncio.Semaphore(self.max_processes)
+            self.__listed = asyncio.Event()
+            self.__listed.set()
+
+    async def __git(self, cmd, input = None, cwd = None):
+        async with self.__semaphore:
+            return await git(cmd, input, cwd)
+
+    def __schedule(self, full):
+        if not self.__pending:
+            self.__pending = (set(), asyncio.get_event_loop().create_future())
+            asyncio.ensure_future(self.__run_pending())
+
+        files, future = self.__pending
+        files.add(full)
+        self.__walks[full] = future
+        return future
+
+    async def __run_pending(self):
+        # queries listing their files now join this walk.
+        try:
+            await asyncio.wait_for(self.__listed.wait(), self.coalesce_delay)
+        except asyncio.TimeoutError:
+            pass
+
+        files, future = self.__pending
+        self.__pending = None
+        head = self.__head
+
+        try:
+            commits = await self.__walk(sorted(files))
+        except Exception as e:
+            future.set_exception(e)
+            # exception is given to every query, or no one if they are cancelled.
+            future.exception()
+        else:
+            if head == self.__head:
+                self.__commits.update(commits)
+            future.set_result(commits)
+        finally:
+            for full in files:
+                if self.__walks.get(full) is future:
+                    del self.__walks[full]
+
+    async def __walk(self, files_full):
+        self.walks_count += 1
+
+        # pathspecs are full paths, so git runs at top-level.
+        top = git_ls_date.find_repository(self.repo)[2]
+        files_parser = FilesParser.from_files(files_full, files_full, top)
+        parser = LogParser(files_parser, self.date_option, compact = True, follow_renames = self.follow_renames,
+                merges = self.merges, lazy = True)
+
+        args, input, separator = parser.log_command()
+        output = await self.__git(args, input, top)
+
+        # parsing is not short for long history. it runs out of the event loop.
+        def parse():
+            for _ in parser.iter_resolved(output.split(separator)):
+                pass
+            return dict((full, (parser.get_first_commit_contains(full), parser.get_last_commit_contains(full)))
+                    for full in files_full)
+
+        return await asyncio.get_event_loop().run_in_executor(None, parse)
+
+async def ls_date(paths = [], repo = None, date = None):
+    """return files with their first and last commits without blocking event loop.
+    use AsyncLsDate to coalesce queries and keep commits.
+    Arg : paths relative to repo, directory in the repository, date option
+    Return : list of Record objects
+    Raise : GitCommandErrorException
+    """
+
+    return await AsyncLsDate(repo, date).ls_date(paths)
@@ -1,6 +1,12 @@
 from setuptools import setup
+import sys
 import git_ls_date
 
+py_modules = ['git_ls_date']
+# git_ls_date_async uses 'async def', which older Pythons can not even compile.
+if sys.version_info >= (3, 5):
+    py_modules.append('git_ls_date_async')
+
 setup(
     name = git_ls_date._name,
     version = git_ls_date._version,
@@ -10,7 +16,7 @@ setup(
     license = git_ls_date._license,
     author = git_ls_date._author,
     author_email = git_ls_date._author_email,
-    py_modules = ['git_ls_date'],
+    py_modules = py_modules,
     entry_points = {
         "console_scripts": ["git-ls-date = git_ls_date:main"]
     },
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
+import time
+import shutil
+import socket
+import tempfile
 from mock import Mock, patch
 from nose.tools import *
 import git_ls_date
@@ -46,36 +51,365 @@ class TestConfiguration(object):
         self.check_date("raw")
         self.check_date("default")
 
+    def test_format_date_option(self):
+        opt = "{ld:iso} {fd:relative: <20} {f}"
+        config = git_ls_date.Configuration()
+        config.argparse(['--format', opt])
+        eq_(config.format, opt)
+
+    def test_format_statistics(self):
+        opt = "{n:>4} {na} {la: <10} {fa} {f}"
+        config = git_ls_date.Configuration()
+        config.argparse(['--format', opt])
+        eq_(config.format, opt)
+
+    @raises(SystemExit)
+    def test_invalid_format(self):
+        config = git_ls_date.Configuration()
+        config.argparse(['--format', "{ld:hoge}"])
+
+    def test_jobs(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["-j", "4"])
+        eq_(config.jobs, 4)
+
+    def test_follow_renames(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--follow-renames"])
+        eq_(config.follow_renames, True)
+
+    def test_merges(self):
+        for merges in ["combined", "first-parent", "skip"]:
+            config = git_ls_date.Configuration()
+            config.argparse(["--merges", merges])
+            eq_(config.merges, merges)
+
+    @raises(SystemExit)
+    def test_invalid_merges(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--merges", "hoge"])
+
+    def test_tree(self):
+        for args, tree in [(["--tree"], -1), (["--tree=2"], 2), (["--tree", "--", "path"], -1)]:
+            config = git_ls_date.Configuration()
+            config.argparse(args)
+            eq_(config.tree, tree)
+        eq_(config.pathes, ["path"])
+
+    @raises(SystemExit)
+    def test_invalid_tree(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--tree=hoge"])
+
+    def test_output(self):
+        for output in ["text", "jsonl", "csv", "z"]:
+            config = git_ls_date.Configuration()
+            config.argparse(["-o", output])
+            eq_(config.output, output)
+
+    @raises(SystemExit)
+    def test_invalid_output(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--output", "hoge"])
+
+    def test_index(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--index"])
+        eq_(config.index, True)
+
+    def test_export_index(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--export-index", "a.idx", "--import-index=b.idx"])
+        eq_(config.export_index, "a.idx")
+        eq_(config.import_index, "b.idx")
+
+    def test_revs(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--rev", "v1"])
+        eq_(config.revs, ["v1"])
+        eq_(config.revision, "v1")
+
+        config = git_ls_date.Configuration()
+        config.argparse(["--rev", "v1", "--rev=HEAD"])
+        eq_(config.revs, ["v1", "HEAD"])
+        eq_(config.revision, None)
+
+    @raises(SystemExit)
+    def test_revs_follow_renames_error(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--rev", "v1", "--rev", "HEAD", "--follow-renames"])
+
+    def test_window(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--since", "90 days ago", "--until=2013-11-01", "--max-commits", "10"])
+        eq_((config.since, config.until, config.max_commits), ("90 days ago", "2013-11-01", 10))
+        eq_(git_ls_date.window_args(config), ["--since=90 days ago", "--until=2013-11-01", "--max-count=10"])
+        eq_(git_ls_date.uses_head_history(config), False)
+
+    @raises(SystemExit)
+    def test_max_commits_error(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--max-commits", "0"])
+
+    def test_repos(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--repo", "a", "--repo=b", "--recurse-submodules", "--repo-jobs", "2"])
+        eq_(config.repos, ["a", "b"])
+        eq_(config.recurse_submodules, True)
+        eq_(config.repo_jobs, 2)
+
+    @raises(SystemExit)
+    def test_invalid_repo_jobs(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--repo-jobs", "0"])
+
+    def test_strategy(self):
+        for strategy in ["auto", "scan", "targeted"]:
+            config = git_ls_date.Configuration()
+            config.argparse(["--strategy", strategy])
+            eq_(config.strategy, strategy)
+
+    def test_sort(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--sort", "ld", "-r", "-n", "20"])
+        eq_(config.sort, "ld")
+        eq_(config.reverse, True)
+        eq_(config.limit, 20)
+
+    @raises(SystemExit)
+    def test_invalid_sort(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--sort", "hoge"])
+
+    @raises(SystemExit)
+    def test_invalid_limit(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--limit", "-1"])
+
+    @raises(SystemExit)
+    def test_invalid_strategy(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--strategy", "hoge"])
+
+    @raises(SystemExit)
+    def test_invalid_jobs(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--jobs", "0"])
+
     def test_format(self):
         opt = "{ld} {lh} {fd} {fh} {f}"
         config = git_ls_date.Configuration()
         config.argparse(['--format', opt])
         eq_(config.format, opt)
 
-    def git_ignore_config(cmd):
-        if cmd == "config --get-regexp git-ls-date":
-            return ""
-        else:
-            return git_ls_date.git(cmd)
-
-    @patch("git_ls_date.git", git_ignore_config)
+    @patch("git_ls_date.read_gitconfig", Mock(return_value={}))
     def test_date_default(self):
         config = git_ls_date.Configuration()
         config.argparse()
         eq_(config.date, "short")
 
-    def git_return_relative(cmd):
-        if cmd == "config --get-regexp git-ls-date":
-            return "git-ls-date.date relative\n"
-        else:
-            return git_ls_date.git(cmd)
-
-    @patch("git_ls_date.git", git_return_relative)
+    @patch("git_ls_date.read_gitconfig", Mock(return_value={"date": "relative"}))
     def test_read_gitconfig(self):
         config = git_ls_date.Configuration()
         config.argparse()
         eq_(config.date, "relative")
 
+class TestFormatFields(object):
+
+    def test_format_fields(self):
+        eq_(git_ls_date.format_fields("{fd} {fh}  {ld} {lh}  {f}"), set(["fd", "fh", "ld", "lh", "f"]))
+        eq_(git_ls_date.format_fields("{ld: <25} {f}"), set(["ld", "f"]))
+        eq_(git_ls_date.format_fields("no placeholder"), set())
+
+    def test_needs_statistics(self):
+        eq_(git_ls_date.needs_statistics("{n:>4} {f}"), True)
+        eq_(git_ls_date.needs_statistics("{ld} {nf} {f}"), False)
+
+class TestSplitShards(object):
+
+    def test_split_by_directory(self):
+        files_full = ["a/1", "a/2", "b/1", "b/2", "c"]
+        shards = git_ls_date.split_shards(files_full, 2)
+
+        eq_(shards, [([0, 1, 4], [":(top,literal)a", ":(top,glob)*"]), ([2, 3], [":(top,literal)b"])])
+
+    def test_large_directory(self):
+        # a directory is never split, since files are not given as pathspecs.
+        shards = git_ls_date.split_shards(["a/%d" % i for i in range(10)] + ["b/0"], 4)
+        eq_(shards, [(list(range(10)), [":(top,literal)a"]), ([10], [":(top,literal)b"])])
+
+    def test_more_jobs_than_files(self):
+        eq_([([0], [":(top,glob)*"])], git_ls_date.split_shards(["a"], 4))
+        eq_([], git_ls_date.split_shards([], 4))
+
+    def test_given_pathspecs(self):
+        # given pathspecs are split, not widened to their directories.
+        files_full = ["a", "d0/x/1", "d0/2", "d1/3"]
+        shards = git_ls_date.split_shards(files_full, 2, ["d0/x/1", "d1/3", ":(literal)a", "d0/*"])
+        eq_(shards, [([1, 2], ["d0/x/1", "d0/*"]), ([0, 3], [":(literal)a", "d1/3"])])
+
+        shards = git_ls_date.split_shards(["d0/2", "d1/3"], 2, ["2", "../d1"], "d0")
+        eq_(shards, [([0], ["2"]), ([1], ["../d1"])])
+
+    def test_unsplittable_pathspecs(self):
+        files_full = ["a", "d0/2"]
+        for pathspecs in [["*"], ["."], ["d0/2", "../a"], [":(glob)**/2"], ["d0/2"]]:
+            eq_(None, git_ls_date.split_shards(files_full, 2, pathspecs))
+
+class TestDate(object):
+
+    timestamp = 1383998635
+    tz = "+0900"
+
+    def test_format_date(self):
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "raw"), "1383998635 +0900")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "iso"), "2013-11-09 21:03:55 +0900")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "rfc"), "Sat, 9 Nov 2013 21:03:55 +0900")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "short"), "2013-11-09")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "default"), "Sat Nov 9 21:03:55 2013 +0900")
+        eq_(git_ls_date.format_date(self.timestamp, "-0130", "iso"), "2013-11-09 10:33:55 -0130")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "iso8601"), "2013-11-09 21:03:55 +0900")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "iso-strict"), "2013-11-09T21:03:55+09:00")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "rfc2822"), "Sat, 9 Nov 2013 21:03:55 +0900")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "unix"), "1383998635")
+        eq_(git_ls_date.format_date(self.timestamp, self.tz, "format:%Y/%m/%d %H %z%Z %%s %s"),
+                "2013/11/09 21 +0900 %s 1383998635")
+
+    def test_parse_date_option(self):
+        eq_(git_ls_date.parse_date_option("iso8601-local"), ("iso", True, None))
+        eq_(git_ls_date.parse_date_option("local"), ("default", True, None))
+        eq_(git_ls_date.parse_date_option("format-local:%H:%M"), ("format", True, "%H:%M"))
+        eq_(git_ls_date.parse_date_option("local-local"), None)
+        eq_(git_ls_date.parse_date_option("hoge-local"), None)
+
+    def test_format_human_date(self):
+        tz = os.environ.get("TZ")
+        os.environ["TZ"] = "UTC"
+        time.tzset()
+        try:
+            now = self.timestamp
+            human = lambda days, tz: git_ls_date.format_human_date(now - days * 86400, tz, now = now)
+            eq_(human(0.5, "+0000"), "12 hours ago")
+            eq_(human(2, "+0000"), "Thu 12:03")
+            eq_(human(2, "+0900"), "Thu 21:03 +0900")
+            eq_(human(30, "+0900"), "Thu Oct 10 21:03")
+            eq_(human(400, "+0000"), "Oct 5 2012")
+        finally:
+            if tz is None:
+                del os.environ["TZ"]
+            else:
+                os.environ["TZ"] = tz
+            time.tzset()
+
+    def test_same_as_git(self):
+        raw = git_ls_date.git(["log", "-1", "--pretty=format:%ad", "--date=raw"]).split(" ")
+        date_options = git_ls_date.date_options + [option + "-local" for option in git_ls_date.date_options
+                if option != "local"] + ["format:%c %z %Z %s", "format-local:%c %z %Z"]
+        for date_option in date_options:
+            date = git_ls_date.git(["log", "-1", "--pretty=format:%ad", "--date=" + date_option])
+            eq_(git_ls_date.format_date(int(raw[0]), raw[1], date_option), date)
+
+    def test_format_relative_date(self):
+        now = self.timestamp
+        eq_(git_ls_date.format_relative_date(now + 10, now), "in the future")
+        eq_(git_ls_date.format_relative_date(now - 1, now), "1 second ago")
+        eq_(git_ls_date.format_relative_date(now - 89, now), "89 seconds ago")
+        eq_(git_ls_date.format_relative_date(now - 90, now), "2 minutes ago")
+        eq_(git_ls_date.format_relative_date(now - 3 * 3600, now), "3 hours ago")
+        eq_(git_ls_date.format_relative_date(now - 3 * 86400, now), "3 days ago")
+        eq_(git_ls_date.format_relative_date(now - 30 * 86400, now), "4 weeks ago")
+        eq_(git_ls_date.format_relative_date(now - 100 * 86400, now), "3 months ago")
+        eq_(git_ls_date.format_relative_date(now - 400 * 86400, now), "1 year, 1 month ago")
+        eq_(git_ls_date.format_relative_date(now - 730 * 86400, now), "2 years ago")
+        eq_(git_ls_date.format_relative_date(now - 3650 * 86400, now), "10 years ago")
+
+    def test_date_field(self):
+        commit = git_ls_date.Commit(self.timestamp, self.tz, "b9720cf", "short")
+        eq_("{0}".format(git_ls_date.DateField(commit)), "2013-11-09")
+        eq_("{0: >12}".format(git_ls_date.DateField(commit)), "  2013-11-09")
+        eq_("{0:raw}".format(git_ls_date.DateField(commit)), "1383998635 +0900")
+        eq_("{0:iso: <26}|".format(git_ls_date.DateField(commit)), "2013-11-09 21:03:55 +0900 |")
+        eq_("{0:iso}".format(git_ls_date.DateField(git_ls_date.no_commit)), "")
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_check_date_option(self):
+        git_ls_date.check_date_option("hoge")
+
+class TestGitconfig(object):
+
+    def setup(self):
+        self.path = os.path.abspath("test_gitconfig")
+
+    def teardown(self):
+        for path in [self.path, self.path + ".inc"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def parse(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+        values = {}
+        git_ls_date.parse_gitconfig(self.path, "git-ls-date", values)
+        return values
+
+    def test_parse(self):
+        values = self.parse('[core]\n\tdate = iso\n[Git-Ls-Date]\n\tDate = relative ; comment\n'
+                '\tformat = "{ld}  {f}" # comment\n\tcache\n\tstrategy = tar\\\ngeted\n')
+        eq_(values, {"date": "relative", "format": "{ld}  {f}", "cache": "true", "strategy": "targeted"})
+
+    def test_escape(self):
+        eq_(self.parse('[git-ls-date]\nformat = "a\\tb\\"c\\\\"\n'), {"format": 'a\tb"c\\'})
+
+    def test_include(self):
+        with open(self.path + ".inc", "w") as f:
+            f.write("[git-ls-date]\ndate = iso\n")
+        eq_(self.parse("[git-ls-date]\ndate = local\n[include]\npath = test_gitconfig.inc\n"), {"date": "iso"})
+        eq_(self.parse('[includeIf "gitdir:/nonexistent/"]\npath = test_gitconfig.inc\n'), {})
+
+    def test_include_if_outside_repository(self):
+        with open(self.path + ".inc", "w") as f:
+            f.write("[git-ls-date]\ndate = iso\n")
+        cwd = os.getcwd()
+        directory = tempfile.mkdtemp()
+        os.chdir(directory)
+        try:
+            for condition in ["gitdir:**", "gitdir/i:**", "onbranch:*"]:
+                eq_(self.parse('[includeIf "%s"]\npath = %s.inc\n' % (condition, self.path)), {})
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+
+    def test_config_bool(self):
+        ok_(git_ls_date.config_bool("Yes"))
+        ok_(git_ls_date.config_bool("1"))
+        ok_(not git_ls_date.config_bool("off"))
+
+    @patch.dict(os.environ, {"GIT_CONFIG_PARAMETERS": "'git-ls-date.date=iso' 'core.x=y'"})
+    def test_config_parameters(self):
+        eq_(git_ls_date.read_gitconfig("git-ls-date")["date"], "iso")
+
+    def test_same_as_git(self):
+        values = git_ls_date.read_gitconfig("user")
+        for line in git_ls_date.git("config --get-regexp ^user\\.").split("\n")[:-1]:
+            key, _, value = line.partition(" ")
+            eq_(values[key[5:]], value)
+
+class TestRepository(object):
+
+    def test_find_repository(self):
+        git_dir, common_dir, top = git_ls_date.find_repository()
+        eq_(top, git_ls_date.git("rev-parse --show-toplevel").strip())
+        eq_(git_dir, os.path.abspath(git_ls_date.git("rev-parse --git-dir").strip()))
+        eq_(common_dir, git_dir)
+
+    def test_read_head(self):
+        eq_(git_ls_date.read_head(), git_ls_date.git("rev-parse HEAD").strip())
+
+    def test_unquote_path(self):
+        eq_(git_ls_date.unquote_path("a b"), "a b")
+        eq_(git_ls_date.unquote_path('"a\\tb\\"c"'), 'a\tb"c')
+        eq_(git_ls_date.unquote_path('"\\343\\201\\202"'), u"\u3042")
+
 class TestGitCommandErrorException(object):
 
     message = "error message"
@@ -101,6 +435,31 @@ class TestGit(object):
     def test_raise(self):
         git_ls_date.git("hoge")
 
+    def test_args(self):
+        output = git_ls_date.git(["config", "--get", "--default", "a b", "hoge.hoge"])
+        eq_(output, "a b\n")
+
+    def test_input(self):
+        output = git_ls_date.git(["hash-object", "--stdin"], "hoge")
+        eq_(len(output), 41)
+        lines = list(git_ls_date.git_lines(["hash-object", "--stdin"], "hoge"))
+        eq_(len(lines), 1)
+        eq_(len(lines[0]), 40)
+
+    def test_lines(self):
+        lines = list(git_ls_date.git_lines("--version"))
+        eq_(len(lines), 1)
+        ok_(lines[0].startswith("git version"))
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_lines_raise(self):
+        list(git_ls_date.git_lines("hoge"))
+
+    def test_lines_close(self):
+        lines = git_ls_date.git_lines("ls-files")
+        ok_(next(lines))
+        lines.close()
+
 class TestFilesParser(object):
 
     def check_files(self, parser, correct_files, correct_files_full):
@@ -142,7 +501,7 @@ class TestFilesParser(object):
         self.check_files(parser, files, files)
 
     def test_no_arg(self):
-        files = [".gitignore", ".python-version", "LICENSE", "MANIFEST.in", "README.rst", "git_ls_date.py", "setup.py", "test_git_ls_date.py", "testfiles/testdirectory/testfile4", "testfiles/testfile1", "testfiles/testfile2", "testfiles/testfile3", "tox.ini"]
+        files = [".gitignore", ".python-version", "LICENSE", "MANIFEST.in", "README.rst", "bench_git_ls_date.py", "git_ls_date.py", "git_ls_date_async.py", "setup.py", "test_git_ls_date.py", "test_git_ls_date_async.py", "testfiles/testdirectory/testfile4", "testfiles/testfile1", "testfiles/testfile2", "testfiles/testfile3", "tox.ini"]
 
         parser = git_ls_date.FilesParser()
         self.check_files(parser, files, files)
@@ -171,7 +530,7 @@ class TestLogParser(object):
 
         # create FilesParser Mock
 
-        pathes = ["testfiles"]
+        pathes = ["."]
         files = ["testfile1", "testfile2", "testfile3", "testdirectory/testfile4"]
         files_full = ["testfiles/testfile1", "testfiles/testfile2", "testfiles/testfile3", "testfiles/testdirectory/testfile4"]
 
@@ -205,6 +564,7 @@ class TestLogParser(object):
 
         self.files_parser_mock = Mock()
         self.files_parser_mock.pathes = pathes
+        self.files_parser_mock.cwd = None
         self.files_parser_mock.files = files
         self.files_parser_mock.files_full = files_full
 
@@ -295,7 +655,970 @@ class TestLogParser(object):
         eq_(None, log_parser.get_last_commit_contains("hoge"))
 
 
+    def test_last_only(self):
+        full_parser = git_ls_date.LogParser(self.files_parser_mock, "raw")
+        log_parser = git_ls_date.LogParser(self.files_parser_mock, "raw", True)
+
+        hashes = [commit.hash for commit in full_parser.commits]
+        oldest_last = 0
+        for file in self.files_parser_mock.files:
+            self.eq_commit(full_parser.get_last_commit_contains(file), log_parser.get_last_commit_contains(file))
+            eq_(None, log_parser.get_first_commit_contains(file))
+            oldest_last = max(oldest_last, hashes.index(full_parser.get_last_commit_contains(file).hash))
+
+        # history walk stops at the oldest of last commits.
+        eq_(oldest_last + 1, len(log_parser.commits))
+
+    def test_compact(self):
+        log_parser = git_ls_date.LogParser(self.files_parser_mock, "raw")
+        compact_parser = git_ls_date.LogParser(self.files_parser_mock, "raw", compact = True)
+
+        eq_([], compact_parser.commits)
+
+        for file in self.files_parser_mock.files:
+            eq_(None, compact_parser.get_commits_contains(file))
+            self.eq_commit(log_parser.get_first_commit_contains(file), compact_parser.get_first_commit_contains(file))
+            self.eq_commit(log_parser.get_last_commit_contains(file), compact_parser.get_last_commit_contains(file))
+            eq_(len(log_parser.get_commits_contains(file)), compact_parser.get_commit_count_contains(file))
+
+        eq_(None, compact_parser.get_first_commit_contains("hoge"))
+        eq_(0, compact_parser.get_commit_count_contains("hoge"))
+
+    def test_jobs(self):
+        compact_parser = git_ls_date.LogParser(self.files_parser_mock, "raw", compact = True)
+        parallel_parser = git_ls_date.LogParser(self.files_parser_mock, "raw", compact = True, jobs = 3)
+
+        for file in self.files_parser_mock.files:
+            self.eq_commit(compact_parser.get_first_commit_contains(file), parallel_parser.get_first_commit_contains(file))
+            self.eq_commit(compact_parser.get_last_commit_contains(file), parallel_parser.get_last_commit_contains(file))
+            eq_(compact_parser.get_commit_count_contains(file), parallel_parser.get_commit_count_contains(file))
+
     @raises(git_ls_date.GitCommandErrorException)
     def test_date_option_error(self):
         log_parser = git_ls_date.LogParser(self.files_parser_mock, "hoge")
 
+class TestPathspecs(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a*", "a"], ["add", "dir/b", "b"]],
+            [["add", "ab", "ab"], ["add", "new\nline", "c"]],
+        ])
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+
+    def test_given_pathspecs(self):
+        parser = git_ls_date.LogParser(git_ls_date.FilesParser(["."]), lazy = True)
+        eq_(parser.log_command()[1], "--\n.\n")
+
+        os.chdir("dir")
+        parser = git_ls_date.LogParser(git_ls_date.FilesParser(), lazy = True)
+        eq_(parser.log_command()[1], "--\n.\n")
+
+    def test_whole_tree(self):
+        for pathes in [[], [":/"]]:
+            parser = git_ls_date.LogParser(git_ls_date.FilesParser(pathes), lazy = True)
+            eq_(parser.log_command()[1], "--\n")
+
+    def test_literal(self):
+        files_parser = git_ls_date.FilesParser.from_files(["a*"], ["a*"])
+        parser = git_ls_date.LogParser(files_parser, "raw", compact = True)
+        eq_(parser.get_last_commit_contains("a*").timestamp, 1383000000)
+        eq_(parser.get_commit_count_contains("a*"), 1)
+
+        targeted_parser = git_ls_date.TargetedLogParser(files_parser, "raw")
+        eq_(targeted_parser.get_last_commit_contains("a*").timestamp, 1383000000)
+
+    def test_newline(self):
+        for files_parser in [git_ls_date.FilesParser(["new\nline"]),
+                git_ls_date.FilesParser.from_files(["new\nline"], ["new\nline"])]:
+            eq_(files_parser.files, ["new\nline"])
+            parser = git_ls_date.LogParser(files_parser, "raw", compact = True)
+            eq_(parser.get_last_commit_contains("new\nline").timestamp, 1383000000 + 86400)
+
+    def test_jobs_pathspecs(self):
+        # shards walk given pathspecs only.
+        files_parser = git_ls_date.FilesParser([":(literal)a*", "dir/b"])
+        entries = []
+        for jobs in [1, 2]:
+            profiler = git_ls_date.profile = git_ls_date.Profiler()
+            profiler.start()
+            try:
+                parser = git_ls_date.LogParser(files_parser, "raw", compact = True, jobs = jobs)
+            finally:
+                git_ls_date.profile = git_ls_date.Profiler()
+            eq_(parser.get_last_commit_contains("dir/b").timestamp, 1383000000)
+            entries.append(profiler.file_entries)
+        eq_(entries, [2, 2])
+
+    def test_jobs(self):
+        files_parser = git_ls_date.FilesParser()
+        parser = git_ls_date.LogParser(files_parser, "raw", compact = True)
+        parallel_parser = git_ls_date.LogParser(files_parser, "raw", compact = True, jobs = 2)
+
+        for file in files_parser.files:
+            eq_(parser.get_last_commit_contains(file).hash, parallel_parser.get_last_commit_contains(file).hash)
+            eq_(parser.get_commit_count_contains(file), parallel_parser.get_commit_count_contains(file))
+
+def create_repository(commits):
+    """create repository in a temporary directory and change directory to it.
+    Arg : list of commands for each commit like [["add", "a", "text"], ["mv", "a", "b"]]
+    Return : path of the repository
+    """
+
+    path = tempfile.mkdtemp()
+    os.chdir(path)
+    git_ls_date.git("init -q")
+
+    for i, commands in enumerate(commits):
+        for command in commands:
+            if command[0] == "add":
+                if os.path.dirname(command[1]) and not os.path.isdir(os.path.dirname(command[1])):
+                    os.makedirs(os.path.dirname(command[1]))
+                with open(command[1], "w") as f:
+                    f.write(command[2])
+                git_ls_date.git(["add", command[1]])
+            elif command[0] == "mv":
+                git_ls_date.git(["mv", command[1], command[2]])
+        date = "%d +0900" % (1383000000 + i * 86400)
+        os.environ["GIT_AUTHOR_DATE"] = os.environ["GIT_COMMITTER_DATE"] = date
+        try:
+            git_ls_date.git(["-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", str(i)])
+        finally:
+            del os.environ["GIT_AUTHOR_DATE"], os.environ["GIT_COMMITTER_DATE"]
+
+    return path
+
+class TestFollowRenames(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        create_repository([
+            [["add", "a", "a\n" * 10], ["add", "b", "b\n" * 10]],
+            [["add", "a", "a\n" * 11]],
+            [["mv", "a", "c"]],
+            [["add", "a", "new a\n"]],
+            [["mv", "b", "d d"]],
+        ])
+        self.files_parser = git_ls_date.FilesParser()
+        self.hashes = git_ls_date.git("log --reverse --pretty=format:%h").split("\n")
+
+    def teardown(self):
+        path = os.getcwd()
+        os.chdir(self.cwd)
+        shutil.rmtree(path)
+
+    def test_first_commit(self):
+        parser = git_ls_date.LogParser(self.files_parser, "raw", compact = True, follow_renames = True)
+
+        eq_(parser.get_first_commit_contains("c").hash, self.hashes[0])
+        eq_(parser.get_last_commit_contains("c").hash, self.hashes[2])
+        eq_(parser.get_commit_count_contains("c"), 3)
+        eq_(parser.get_origin_path("c"), "a")
+
+        # path renamed away belongs to the renamed file before the rename.
+        eq_(parser.get_first_commit_contains("a").hash, self.hashes[3])
+        eq_(parser.get_commit_count_contains("a"), 1)
+        eq_(parser.get_first_commit_contains("d d").hash, self.hashes[0])
+
+    def test_not_follow(self):
+        parser = git_ls_date.LogParser(self.files_parser, "raw", compact = True)
+
+        eq_(parser.get_first_commit_contains("c").hash, self.hashes[2])
+        eq_(parser.get_origin_path("c"), "c")
+
+    def test_cache(self):
+        cache = git_ls_date.LogCache(self.files_parser, "raw", persistent = False, follow_renames = True)
+        eq_(cache.get_first_commit_contains("c").hash, self.hashes[0])
+
+        git_ls_date.git(["mv", "c", "e"])
+        git_ls_date.git(["-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", "mv"])
+        cache.update()
+
+        cache = cache.for_files(git_ls_date.FilesParser())
+        eq_(cache.get_first_commit_contains("e").hash, self.hashes[0])
+
+class TestMerges(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        create_repository([[["add", "a", "a"]], [["add", "b", "b"]]])
+
+        user = ["-c", "user.name=test", "-c", "user.email=test@example.com"]
+        git_ls_date.git("checkout -q -b side HEAD~1")
+        with open("c", "w") as f:
+            f.write("c")
+        git_ls_date.git("add c")
+        git_ls_date.git(user + ["commit", "-q", "-m", "side"])
+        self.side = git_ls_date.git("rev-parse --short HEAD").strip()
+        git_ls_date.git("checkout -q -")
+        git_ls_date.git(user + ["merge", "-q", "--no-ff", "-m", "merge", "side"])
+        self.merge = git_ls_date.git("rev-parse --short HEAD").strip()
+
+        self.files_parser = git_ls_date.FilesParser()
+
+    def teardown(self):
+        path = os.getcwd()
+        os.chdir(self.cwd)
+        shutil.rmtree(path)
+
+    def test_merges(self):
+        for merges, first in [("combined", self.side), ("first-parent", self.merge), ("skip", self.side)]:
+            for follow_renames in [False, True]:
+                parser = git_ls_date.LogParser(self.files_parser, "raw", compact = True, merges = merges,
+                        follow_renames = follow_renames)
+                eq_(parser.get_first_commit_contains("c").hash, first)
+                eq_(parser.get_last_commit_contains("c").hash, first)
+                eq_(parser.get_commit_count_contains("c"), 1)
+
+            parser = git_ls_date.TargetedLogParser(self.files_parser, "raw", merges = merges)
+            eq_(parser.get_first_commit_contains("c").hash, first)
+
+    def test_commit_without_file(self):
+        # merge without combined diff must not take files of next commit.
+        parser = git_ls_date.LogParser(self.files_parser, "raw", merges = "combined")
+        eq_([c.hash for c in parser.get_commits_contains("b")], [git_ls_date.git("rev-parse --short HEAD~1").strip()])
+
+class TestLsDate(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "b", "b"]],
+            [["add", "a", "aa"]],
+        ])
+        self.hashes = git_ls_date.git("log --reverse --pretty=format:%h").split("\n")
+        with open("c", "w") as f:
+            f.write("c")
+        git_ls_date.git("add c")
+
+        # ls_date does not depend on the current directory.
+        os.chdir(self.cwd)
+
+    def teardown(self):
+        shutil.rmtree(self.repo)
+
+    def test_ls_date(self):
+        records = dict((r.path, r) for r in git_ls_date.ls_date(repo = self.repo, date = "raw"))
+
+        eq_(sorted(records), ["a", "b", "c"])
+        eq_((records["a"].first.hash, records["a"].last.hash), (self.hashes[0], self.hashes[1]))
+        eq_(records["a"].last.date, "%d +0900" % (1383000000 + 86400))
+        eq_((records["c"].first, records["c"].last), (None, None))
+
+    def test_every_field(self):
+        for field in git_ls_date.record_fields:
+            records = list(git_ls_date.ls_date(["a"], repo = self.repo, fields = [field]))
+
+            eq_([(r.path, r.full_path) for r in records], [("a", "a")])
+            eq_(records[0].last.hash, self.hashes[1])
+            eq_(records[0].first and records[0].first.hash, self.hashes[0] if field in ["fd", "fh"] else None)
+
+    def test_last_only(self):
+        records = list(git_ls_date.ls_date(["a", "c"], repo = self.repo, fields = ["ld", "f"]))
+
+        eq_([r.path for r in records], ["a", "c"])
+        eq_((records[0].first, records[0].last.hash), (None, self.hashes[1]))
+
+    def test_cache(self):
+        cache = git_ls_date.LogCache(None, persistent = False, cwd = self.repo)
+        records = list(git_ls_date.ls_date(["b"], repo = self.repo, cache = cache))
+        eq_(records[0].first.hash, self.hashes[0])
+
+    @raises(ValueError)
+    def test_unknown_field(self):
+        git_ls_date.ls_date(fields = ["hoge"])
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_date_option_error(self):
+        git_ls_date.ls_date(date = "hoge")
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_not_repository(self):
+        list(git_ls_date.ls_date(repo = tempfile.gettempdir()))
+
+class TestLogCache(object):
+
+    def setup(self):
+        self.files_parser = git_ls_date.FilesParser()
+
+    def teardown(self):
+        path = os.path.join(git_ls_date.git("rev-parse --git-dir").strip(), git_ls_date.LogCache.cache_name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def eq_commit(self, correct_commit, commit):
+        eq_(correct_commit.hash, commit.hash)
+        eq_(correct_commit.date, commit.date)
+
+    def test_same_as_log_parser(self):
+        log_parser = git_ls_date.LogParser(self.files_parser, "raw")
+
+        # first run builds the cache, second run reads it.
+        for i in range(2):
+            cache = git_ls_date.LogCache(self.files_parser, "raw")
+            ok_(os.path.exists(cache.path))
+            eq_(cache.head, git_ls_date.git("rev-parse HEAD").strip())
+
+            for file in self.files_parser.files:
+                self.eq_commit(log_parser.get_first_commit_contains(file), cache.get_first_commit_contains(file))
+                self.eq_commit(log_parser.get_last_commit_contains(file), cache.get_last_commit_contains(file))
+
+    def test_not_contains(self):
+        cache = git_ls_date.LogCache(self.files_parser, "raw")
+
+        eq_(None, cache.get_first_commit_contains("hoge"))
+        eq_(None, cache.get_last_commit_contains("hoge"))
+
+class TestLogCacheUpdate(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"]],
+        ])
+        git_ls_date.git("branch side")
+        self.commit("a", "main", 1400000000)
+        self.main = git_ls_date.git("rev-parse HEAD").strip()
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+
+    def commit(self, path, text, timestamp, args = []):
+        with open(path, "w") as f:
+            f.write(text)
+        git_ls_date.git(["add", path])
+        os.environ["GIT_AUTHOR_DATE"] = os.environ["GIT_COMMITTER_DATE"] = "%d +0000" % timestamp
+        try:
+            git_ls_date.git(["-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q",
+                "-m", text] + args)
+        finally:
+            del os.environ["GIT_AUTHOR_DATE"], os.environ["GIT_COMMITTER_DATE"]
+
+    def test_merge_older_branch(self):
+        for merges in ["combined", "first-parent", "skip"]:
+            git_ls_date.git(["checkout", "-q", "-B", "work", self.main])
+            cache = git_ls_date.LogCache(None, "raw", persistent = False, merges = merges)
+
+            # side branch is older than the commit of main.
+            git_ls_date.git("checkout -q side")
+            self.commit("a", "side", 1390000000)
+            self.commit("b", "side b", 1390000001)
+            git_ls_date.git("checkout -q work")
+            os.environ["GIT_AUTHOR_DATE"] = os.environ["GIT_COMMITTER_DATE"] = "1410000000 +0000"
+            try:
+                git_ls_date.git(["-c", "user.name=test", "-c", "user.email=test@example.com", "merge", "-q",
+                    "-X", "ours", "-m", "merge", "side"])
+            finally:
+                del os.environ["GIT_AUTHOR_DATE"], os.environ["GIT_COMMITTER_DATE"]
+            git_ls_date.git("branch -f side side~2")
+
+            cache.update()
+            files_parser = git_ls_date.FilesParser()
+            cache = cache.for_files(files_parser, "raw")
+            parser = git_ls_date.LogParser(files_parser, "raw", merges = merges)
+            for f in files_parser.files:
+                for get in ["get_first_commit_contains", "get_last_commit_contains"]:
+                    eq_(getattr(cache, get)(f).hash, getattr(parser, get)(f).hash)
+
+class TestRepositories(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repos = [create_repository([[["add", "a", "a"]]]), create_repository([[["add", "b", "b"]]])]
+        os.chdir(self.repos[0])
+
+        user = ["-c", "user.name=test", "-c", "user.email=test@example.com"]
+        git_ls_date.git(["-c", "protocol.file.allow=always", "submodule", "-q", "add", self.repos[1], "sub"])
+        git_ls_date.git(user + ["commit", "-q", "-m", "submodule"])
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        for repo in self.repos:
+            shutil.rmtree(repo)
+
+    def run(self, args):
+        config = git_ls_date.Configuration()
+        config.argparse(args)
+        with patch("sys.stdout", git_ls_date.StringIO()) as stdout, patch("sys.stderr", git_ls_date.StringIO()) as stderr:
+            status = git_ls_date.run_repositories(config)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_list_submodules(self):
+        eq_(git_ls_date.list_submodules("."), ["sub"])
+
+    def test_repos(self):
+        missing = os.path.join(self.repos[1], "missing")
+        status, stdout, stderr = self.run(["--repo", self.repos[1], "--repo", missing, "--repo", ".", "-f", "{r} {f}", "b", "a"])
+
+        eq_(status, 1)
+        eq_(stdout, "%s b\n. a\n" % self.repos[1])
+        ok_(stderr.startswith("error: %s: " % missing))
+
+    def test_recurse_submodules(self):
+        status, stdout, stderr = self.run(["--recurse-submodules", "-o", "csv", "-f", "{r} {f}"])
+
+        eq_(status, 0)
+        eq_(stdout, "r,f\n.,.gitmodules\n.,a\n.,sub\nsub,b\n")
+
+    def test_csv_header(self):
+        # header is written once, even if the first repository fails.
+        missing = os.path.join(self.repos[1], "missing")
+        status, stdout, stderr = self.run(["--repo", missing, "--repo", ".", "--repo", ".", "-o", "csv", "-f", "{f}", "a"])
+
+        eq_(status, 1)
+        eq_(stdout, "f\na\na\n")
+
+class TestLogIndex(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "dir/b", "b"]],
+            [["add", "a", "aa"], ["add", "dir/c", "c"]],
+        ])
+        self.files_parser = git_ls_date.FilesParser()
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+
+    def test_same_as_log_parser(self):
+        log_parser = git_ls_date.LogParser(self.files_parser, "raw")
+
+        # first run builds the index, second run maps it.
+        for i in range(2):
+            index = git_ls_date.LogIndex(self.files_parser, "raw")
+            eq_(index.head, git_ls_date.git("rev-parse HEAD").strip())
+
+            for file in self.files_parser.files:
+                for get in ["get_first_commit_contains", "get_last_commit_contains"]:
+                    correct, commit = getattr(log_parser, get)(file), getattr(index, get)(file)
+                    eq_((correct.hash, correct.date), (commit.hash, commit.date))
+
+        eq_(index.lookup("hoge"), None)
+
+    def test_find_files(self):
+        index = git_ls_date.LogIndex(None)
+
+        # files are named as git ls-files shows them.
+        files_parser = index.find_files(["dir/b", "./a", "a"])
+        eq_((files_parser.files, files_parser.files_full), (["a", "dir/b"], ["a", "dir/b"]))
+        eq_(index.for_files(files_parser).get_last_commit_contains("a").timestamp, 1383000000 + 86400)
+
+        os.chdir("dir")
+        files_parser = index.find_files(["../a", "./c"])
+        eq_((files_parser.files, files_parser.files_full), (["../a", "c"], ["a", "dir/c"]))
+        eq_(files_parser.files, git_ls_date.FilesParser(["../a", "./c"]).files)
+        eq_(index.find_files(["."]), None)
+        eq_(index.find_files(["*"]), None)
+
+    def test_rebuild(self):
+        # commit only into the temporary repository, whatever the current directory is.
+        repo = self.repo
+        eq_(os.path.realpath(git_ls_date.find_repository(repo)[2]), os.path.realpath(repo))
+
+        index = git_ls_date.LogIndex(None, cwd = repo)
+        git_ls_date.git(["-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q",
+            "--allow-empty", "-m", "empty"], cwd = repo)
+
+        eq_(git_ls_date.LogIndex(None, cwd = repo).head, git_ls_date.git("rev-parse HEAD", cwd = repo).strip())
+
+        with open(index.path, "wb") as f:
+            f.write(b"broken")
+        eq_(git_ls_date.LogIndex(None, cwd = repo).lookup("a")[1].timestamp, 1383000000 + 86400)
+
+class TestExportIndex(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "dir/b", "b"]],
+            [["add", "a", "aa"]],
+        ])
+        self.path = self.repo + ".idx"
+        git_ls_date.LogCache(None, "raw", persistent = False).export_index(self.path)
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+        os.remove(self.path)
+
+    def test_import(self):
+        files_parser = git_ls_date.FilesParser()
+        cache = git_ls_date.LogCache(files_parser, "raw", persistent = False, index_file = self.path)
+        log_parser = git_ls_date.LogParser(files_parser, "raw")
+
+        for file in files_parser.files:
+            eq_(log_parser.get_first_commit_contains(file).hash, cache.get_first_commit_contains(file).hash)
+            eq_(log_parser.get_last_commit_contains(file).hash, cache.get_last_commit_contains(file).hash)
+
+    def test_import_walks_new_commits(self):
+        exported_head = git_ls_date.git("rev-parse HEAD").strip()
+        with open("dir/b", "w") as f:
+            f.write("bb")
+        git_ls_date.git(["-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-a", "-m", "2"])
+
+        cache = git_ls_date.LogCache(git_ls_date.FilesParser(), "raw", persistent = False, index_file = self.path)
+        eq_(cache.head, git_ls_date.git("rev-parse HEAD").strip())
+        eq_(cache.get_first_commit_contains("dir/b").timestamp, 1383000000)
+        eq_(cache.get_last_commit_contains("dir/b").hash, cache.head[:len(cache.get_last_commit_contains("a").hash)])
+        eq_(cache.get_last_commit_contains("a").hash, exported_head[:len(cache.get_last_commit_contains("a").hash)])
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_corrupted(self):
+        with open(self.path, "ab") as f:
+            f.write(b"broken")
+        git_ls_date.LogCache(None, persistent = False, index_file = self.path)
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_other_mode(self):
+        git_ls_date.LogCache(None, persistent = False, merges = "skip", index_file = self.path)
+
+class TestStatistics(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "b", "b"]],
+            [["add", "a", "aa"]],
+        ])
+        with open("a", "w") as f:
+            f.write("aaa")
+        git_ls_date.git(["-c", "user.name=other person", "-c", "user.email=other@example.com", "commit", "-q", "-a",
+            "-m", "2"])
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+
+    def check(self, parser):
+        eq_(parser.get_commit_count_contains("a"), 3)
+        eq_(parser.get_commit_count_contains("b"), 1)
+        eq_(parser.get_authors_contains("a"), set(["test", "other person"]))
+        eq_(parser.get_last_commit_contains("a").author, "other person")
+        eq_(parser.get_first_commit_contains("a").author, "test")
+
+    def test_authors(self):
+        files_parser = git_ls_date.FilesParser()
+        for kwargs in [{}, {"compact": True}, {"compact": True, "jobs": 2}, {"compact": True, "follow_renames": True}]:
+            self.check(git_ls_date.LogParser(files_parser, authors = True, **kwargs))
+
+    def test_no_authors(self):
+        parser = git_ls_date.LogParser(git_ls_date.FilesParser(), compact = True)
+        eq_(parser.get_authors_contains("a"), None)
+        eq_(parser.get_last_commit_contains("a").author, None)
+
+    def test_create_parser(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--cache", "--strategy", "targeted", "--format", "{na} {f}"])
+        self.check(git_ls_date.create_parser(config, git_ls_date.FilesParser()))
+
+class TestRevisions(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "dir/b", "b"]],
+            [["add", "a", "aa"]],
+            [["add", "dir/b", "bb"], ["add", "c", "c"]],
+        ])
+        git_ls_date.git("tag v1 HEAD~1")
+        git_ls_date.git("branch side HEAD~2")
+        self.revs = ["v1", "side", "HEAD"]
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+
+    def test_files_parser(self):
+        eq_(git_ls_date.FilesParser(revision = "v1").files, ["a", "dir/b"])
+        eq_(git_ls_date.FilesParser(["dir"], revision = "HEAD").files, ["dir/b"])
+
+    def test_same_as_log_parser(self):
+        parser = git_ls_date.RevisionsLogParser(self.revs, date_option = "raw", authors = True)
+
+        for i, rev in enumerate(self.revs):
+            files_parser, log = parser.for_revision(i)
+            log_parser = git_ls_date.LogParser(git_ls_date.FilesParser(revision = rev), "raw", revision = rev,
+                    compact = True, authors = True)
+
+            eq_(files_parser.files, log_parser.files_parser.files)
+            for f in files_parser.files:
+                for get in ["get_first_commit_contains", "get_last_commit_contains"]:
+                    eq_(getattr(log, get)(f).hash, getattr(log_parser, get)(f).hash)
+                eq_(log.get_commit_count_contains(f), log_parser.get_commit_count_contains(f))
+                eq_(log.get_authors_contains(f), log_parser.get_authors_contains(f))
+
+    def test_one_walk(self):
+        profiler = git_ls_date.profile = git_ls_date.Profiler()
+        profiler.start()
+        try:
+            git_ls_date.RevisionsLogParser(self.revs)
+        finally:
+            git_ls_date.profile = git_ls_date.Profiler()
+        eq_(len([p for p in profiler.processes if p["args"].startswith("log")]), 1)
+
+    def test_create_parser(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--rev", "v1", "--cache"])
+        files_parser = git_ls_date.FilesParser(revision = config.revision)
+        parser = git_ls_date.create_parser(config, files_parser)
+        eq_(parser.get_last_commit_contains("dir/b").timestamp, 1383000000)
+
+class TestWindow(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "b", "b"]],
+            [["add", "a", "aa"]],
+            [["add", "a", "aaa"]],
+        ])
+        self.files_parser = git_ls_date.FilesParser()
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+
+    def test_since(self):
+        parser = git_ls_date.LogParser(self.files_parser, "raw", compact = True,
+                window = ["--since=%d" % (1383000000 + 3600)])
+        eq_(parser.get_first_commit_contains("a").timestamp, 1383000000 + 86400)
+        eq_(parser.get_commit_count_contains("a"), 2)
+        eq_(parser.get_last_commit_contains("b"), None)
+
+    def test_max_commits(self):
+        for jobs in [1, 2]:
+            parser = git_ls_date.LogParser(self.files_parser, "raw", compact = True, jobs = jobs,
+                    window = ["--max-count=1"])
+            eq_(parser.get_first_commit_contains("a").timestamp, 1383000000 + 86400 * 2)
+            eq_(parser.get_last_commit_contains("b"), None)
+
+    def test_shallow(self):
+        eq_(git_ls_date.read_shallow(), set())
+
+        clone = self.repo + "-shallow"
+        git_ls_date.git(["clone", "-q", "--depth", "1", "file://" + self.repo, clone])
+        try:
+            shallow = git_ls_date.read_shallow(clone)
+            eq_(shallow, set([git_ls_date.git("rev-parse HEAD").strip()]))
+
+            files_parser = git_ls_date.FilesParser(cwd = clone)
+            parser = git_ls_date.LogParser(files_parser, compact = True)
+            formatter = git_ls_date.RowFormatter("{st}", shallow = shallow)
+            ok_(formatter.is_boundary(parser.get_first_commit_contains("b")))
+        finally:
+            shutil.rmtree(clone)
+
+class TestTargetedLogParser(object):
+
+    def setup(self):
+        self.files_parser = git_ls_date.FilesParser()
+
+    def eq_commit(self, correct_commit, commit):
+        eq_(correct_commit.hash, commit.hash)
+        eq_(correct_commit.date, commit.date)
+
+    def test_same_as_log_parser(self):
+        log_parser = git_ls_date.LogParser(self.files_parser, "raw")
+        targeted_parser = git_ls_date.TargetedLogParser(self.files_parser, "raw", jobs = 4)
+
+        for file in self.files_parser.files:
+            self.eq_commit(log_parser.get_first_commit_contains(file), targeted_parser.get_first_commit_contains(file))
+            self.eq_commit(log_parser.get_last_commit_contains(file), targeted_parser.get_last_commit_contains(file))
+
+    def test_last_only(self):
+        targeted_parser = git_ls_date.TargetedLogParser(self.files_parser, "raw", True)
+
+        for file in self.files_parser.files:
+            eq_(None, targeted_parser.get_first_commit_contains(file))
+            ok_(targeted_parser.get_last_commit_contains(file))
+
+    def test_not_contains(self):
+        targeted_parser = git_ls_date.TargetedLogParser(self.files_parser, "raw")
+
+        eq_(None, targeted_parser.get_first_commit_contains("hoge"))
+        eq_(None, targeted_parser.get_last_commit_contains("hoge"))
+
+class TestPlanStrategy(object):
+
+    def test_many_files(self):
+        files = ["file%d" % i for i in range(git_ls_date.targeted_max_files + 1)]
+        files_parser = git_ls_date.FilesParser.from_files(files, files)
+        eq_("scan", git_ls_date.plan_strategy(files_parser))
+
+    def test_few_files(self):
+        files_parser = git_ls_date.FilesParser("setup.py")
+        ok_(git_ls_date.plan_strategy(files_parser, True) in ["scan", "targeted"])
+
+class TestPlanStrategyProcesses(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "b", "b"]],
+            [["add", "a", "aa"]],
+        ])
+        self.profiler = git_ls_date.profile = git_ls_date.Profiler()
+
+    def teardown(self):
+        git_ls_date.profile = git_ls_date.Profiler()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repo)
+
+    def processes(self, plan):
+        self.profiler.start()
+        plan()
+        return [p["args"] for p in self.profiler.processes]
+
+    def test_no_count(self):
+        # history is not counted if the cost of it does not matter.
+        files_parser = git_ls_date.FilesParser(["a"])
+        eq_(self.processes(lambda: eq_("scan", git_ls_date.plan_strategy(files_parser))), [])
+        eq_(self.processes(lambda: eq_("targeted", git_ls_date.plan_strategy(files_parser, True))), [])
+
+        # without Bloom filters, queries of more files than jobs cost more than a scan.
+        files_parser = git_ls_date.FilesParser()
+        eq_(self.processes(lambda: eq_("scan", git_ls_date.plan_strategy(files_parser, True))), [])
+        eq_(self.processes(lambda: eq_("targeted", git_ls_date.plan_strategy(files_parser, True, 2))), [])
+
+    def test_revision(self):
+        git_ls_date.git("commit-graph write --reachable --changed-paths")
+        files_parser = git_ls_date.FilesParser(revision = "HEAD~1")
+        processes = self.processes(lambda: git_ls_date.plan_strategy(files_parser, True, 1, "HEAD~1"))
+        eq_(processes, ["rev-list --count HEAD~1 --"])
+
+    def test_no_commit_fields(self):
+        config = git_ls_date.Configuration()
+        config.argparse(["--format", "{nf} {f}", "--sort", "f"])
+        files_parser = git_ls_date.FilesParser(config.pathes)
+
+        processes = self.processes(lambda: self.write(config, files_parser))
+        eq_(processes, [])
+        eq_(self.output, "1 a\n1 b\n")
+
+    def write(self, config, files_parser):
+        output = git_ls_date.StringIO()
+        parser = git_ls_date.create_parser(config, files_parser)
+        git_ls_date.RowFormatter(config.format, config.output).write(
+                git_ls_date.select_files(config, files_parser, parser), output)
+        self.output = output.getvalue()
+
+    def test_cache(self):
+        # strategy is not planned if cache answers.
+        config = git_ls_date.Configuration()
+        config.argparse(["--cache", "--format", "{ld} {f}", "a", "b"])
+        files_parser = git_ls_date.FilesParser(config.pathes)
+        processes = self.processes(lambda: git_ls_date.create_parser(config, files_parser))
+        ok_(not [p for p in processes if p.startswith("rev-list")])
+
+class TestServer(object):
+
+    def setup(self):
+        config = git_ls_date.Configuration()
+        config.argparse()
+        self.server = git_ls_date.Server(config)
+
+    def test_query(self):
+        files_parser = git_ls_date.FilesParser(":/setup.py")
+        log_parser = git_ls_date.LogParser(files_parser, "raw")
+        lc = log_parser.get_last_commit_contains(files_parser.files[0])
+
+        top = git_ls_date.git("rev-parse --show-toplevel").strip()
+        status, output = self.server.query(top, ["-d", "raw", "-f", "{ld} {lh} {f}", "setup.py"])
+        eq_(status, 0)
+        eq_(output, "%s %s setup.py\n" % (lc.date, lc.hash))
+
+    def test_query_error(self):
+        status, output = self.server.query(os.getcwd(), ["--bar"])
+        eq_(status, 1)
+        ok_("Usage:" in output)
+
+    def handle(self, request):
+        conn, client = socket.socketpair()
+        try:
+            client.sendall(json.dumps(request).encode())
+            client.shutdown(socket.SHUT_WR)
+            self.server._Server__handle(conn)
+            conn.close()
+            return json.loads(git_ls_date.recv_all(client).decode())
+        finally:
+            conn.close()
+            client.close()
+
+    def test_handle_error(self):
+        # server replies the error and keeps running.
+        cwd = os.getcwd()
+        for request in [{"cwd": "/nonexistent", "args": []}, {"args": []}]:
+            response = self.handle(request)
+            eq_(response["status"], 1)
+            ok_(response["output"].startswith("error: "))
+            eq_(os.getcwd(), cwd)
+
+        eq_(self.handle({"cwd": cwd, "args": ["--bar"]})["status"], 1)
+
+    def test_not_running(self):
+        eq_(None, git_ls_date.connect(["setup.py"]))
+
+    def test_lists_repositories(self):
+        ok_(git_ls_date.lists_repositories(["--repo", "/x", "a"]))
+        ok_(git_ls_date.lists_repositories(["--repos-from=list"]))
+        # abbreviation of --recurse-submodules.
+        ok_(git_ls_date.lists_repositories(["-f", "{f}", "--recurse"]))
+        ok_(not git_ls_date.lists_repositories(["--repo-jobs", "2", "a"]))
+        ok_(not git_ls_date.lists_repositories(["--bar"]))
+
+class TestSelectFiles(object):
+
+    def setup(self):
+        files = ["a", "b", "c", "d"]
+        self.files_parser = git_ls_date.FilesParser.from_files(files, files)
+
+        commits = {
+                "a": (git_ls_date.Commit(100, "+0900", "1111111"), git_ls_date.Commit(400, "+0900", "4444444")),
+                "b": (git_ls_date.Commit(200, "+0900", "2222222"), git_ls_date.Commit(300, "+0900", "3333333")),
+                "c": (git_ls_date.Commit(50, "+0900", "0000000"), git_ls_date.Commit(500, "+0900", "5555555")),
+                "d": (None, None)
+            }
+
+        self.parser = Mock()
+        self.parser.get_first_commit_contains.side_effect = lambda f: commits[f][0]
+        self.parser.get_last_commit_contains.side_effect = lambda f: commits[f][1]
+
+    def select(self, args):
+        config = git_ls_date.Configuration()
+        config.argparse(args)
+        return [info[0] for info in git_ls_date.select_files(config, self.files_parser, self.parser)]
+
+    def test_no_sort(self):
+        eq_(self.select([]), ["a", "b", "c", "d"])
+        eq_(self.select(["-n", "2"]), ["a", "b"])
+
+    def test_sort(self):
+        eq_(self.select(["--sort", "ld"]), ["b", "a", "c", "d"])
+        eq_(self.select(["--sort", "fd"]), ["c", "a", "b", "d"])
+        eq_(self.select(["--sort", "f", "--reverse"]), ["d", "c", "b", "a"])
+
+    def test_limit(self):
+        eq_(self.select(["--sort", "ld", "--limit", "2"]), ["b", "a"])
+        eq_(self.select(["--sort", "ld", "-r", "-n", "2"]), ["c", "a"])
+        eq_(self.select(["--sort", "fd", "-n", "10"]), ["c", "a", "b", "d"])
+        eq_(self.select(["--sort", "fd", "-n", "0"]), [])
+
+class TestRollUp(object):
+
+    def test_roll_up(self):
+        c1 = git_ls_date.Commit(100, "+0900", "1111111")
+        c2 = git_ls_date.Commit(200, "+0900", "2222222")
+        c3 = git_ls_date.Commit(300, "+0900", "3333333")
+        files = [("a", c2, c2, 1, 1, set(["p"])), ("x/b", c1, c2, 1, 2, set(["p", "q"])), ("x/y/c", c2, c3, 1, 2, set(["q"])),
+                ("x/y/d", git_ls_date.no_commit, git_ls_date.no_commit, 1, 0, set())]
+
+        directories = git_ls_date.roll_up(files)
+        eq_([(d, fc.hash, lc.hash, n) for d, fc, lc, n, _, _ in directories],
+                [(".", "1111111", "3333333", 4), ("x", "1111111", "3333333", 3), ("x/y", "2222222", "3333333", 2)])
+
+        eq_([d[0] for d in git_ls_date.roll_up(files, 1)], [".", "x"])
+        eq_(git_ls_date.roll_up(files, 1)[1][3], 3)
+
+    def test_statistics(self):
+        c1 = git_ls_date.Commit(100, "+0900", "1111111")
+        files = [("a", c1, c1, 1, 1, set(["p"])), ("x/b", c1, c1, 1, 2, set(["p", "q"])), ("x/c", c1, c1, 1, 3, set(["r"]))]
+
+        eq_([(d, n, authors) for d, _, _, _, n, authors in git_ls_date.roll_up(files)],
+                [(".", 6, set(["p", "q", "r"])), ("x", 5, set(["p", "q", "r"]))])
+        eq_(files[0][5], set(["p"]))
+
+        eq_(git_ls_date.roll_up([("a", c1, c1, 1, None, None)])[0][4:], (None, None))
+
+    def test_uncommitted(self):
+        directories = git_ls_date.roll_up([("x/a", git_ls_date.no_commit, git_ls_date.no_commit, 1, None, None)])
+        eq_(directories[1][1], git_ls_date.no_commit)
+
+class TestRowFormatter(object):
+
+    def setup(self):
+        commit = git_ls_date.Commit(1383000000, "+0900", "1111111", "short")
+        self.rows = [('a "b"', commit, commit, 1), ("c\nd", git_ls_date.no_commit, git_ls_date.no_commit, 1)]
+
+    def write(self, format, output, rows = None):
+        stream = git_ls_date.StringIO()
+        git_ls_date.RowFormatter(format, output).write(rows or self.rows, stream)
+        return stream.getvalue()
+
+    def test_text(self):
+        eq_(self.write("{ld} {lh}  {{{f}}}", "text"), '2013-10-29 1111111  {a "b"}\n   {c\nd}\n')
+        eq_(self.write("{ld:raw: >16}|{fd:iso}|{nf}|{d}", "text").split("\n")[0],
+                "1383000000 +0900|2013-10-29 07:40:00 +0900|1|.")
+
+    def test_z(self):
+        eq_(self.write("{f}", "z"), 'a "b"\0c\nd\0')
+
+    def test_jsonl(self):
+        lines = self.write("{ld: <20} {ld:raw} {f}", "jsonl").split("\n")
+        eq_(json.loads(lines[0]), {"ld": "2013-10-29", "ld:raw": "1383000000 +0900", "f": 'a "b"'})
+        eq_(json.loads(lines[1]), {"ld": "", "ld:raw": "", "f": "c\nd"})
+        eq_(lines[2], "")
+
+    def test_csv(self):
+        eq_(self.write("{lh} {f}", "csv"), 'lh,f\n1111111,"a ""b"""\n,"c\nd"\n')
+
+    def test_statistics(self):
+        first = git_ls_date.Commit(1383000000, "+0900", "1111111", "short", "alice")
+        last = git_ls_date.Commit(1383000000, "+0900", "2222222", "short", "bob")
+        rows = [("a", first, last, 1, 3, set(["alice", "bob"])),
+                ("b", git_ls_date.no_commit, git_ls_date.no_commit, 1, 0, set())]
+        eq_(self.write("{n} {na} {fa} {la} {f}", "text", rows), "3 2 alice bob a\n0 0   b\n")
+
+    def test_revision(self):
+        stream = git_ls_date.StringIO()
+        git_ls_date.RowFormatter("{rv} {f}", "text", revision = "v1").write(self.rows[:1], stream)
+        eq_(stream.getvalue(), 'v1 a "b"\n')
+        eq_(self.write("{rv}", "text", self.rows[:1]), "HEAD\n")
+
+    def test_status(self):
+        formatter = git_ls_date.RowFormatter("{st}", "text", shallow = set(["1111111" + "0" * 33]))
+        eq_(formatter.status(self.rows[0]), "boundary")
+        eq_(formatter.status(self.rows[1]), "untouched")
+        eq_(self.write("{st}", "text"), "\nuntouched\n")
+
+    def test_unused_fields(self):
+        # commits are not touched if format uses only filename.
+        eq_(self.write("{f}", "text", [("a", None, None, 1)]), "a\n")
+
+class TestProfiler(object):
+
+    def setup(self):
+        self.profiler = git_ls_date.Profiler()
+        git_ls_date.profile = self.profiler
+
+    def teardown(self):
+        git_ls_date.profile = git_ls_date.Profiler()
+
+    def test_disabled(self):
+        git_ls_date.git("--version")
+        eq_(self.profiler.processes, [])
+
+    def test_report(self):
+        self.profiler.start()
+
+        files_parser = git_ls_date.FilesParser()
+        self.profiler.lap("files")
+        git_ls_date.LogParser(files_parser, "raw", compact = True)
+        self.profiler.lap("log")
+
+        output = git_ls_date.StringIO()
+        self.profiler.report(output)
+        report = json.loads(output.getvalue())
+
+        eq_(["files", "log"], [phase["phase"] for phase in report["phases"]])
+        eq_(2, report["git_processes"])
+        ok_(report["bytes_read"] > 0)
+        ok_(report["commits"] > 0)
+        ok_(report["file_entries"] >= len(files_parser.files))
+        ok_("read_wait" in report["processes"][1])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+from nose import SkipTest
+from nose.tools import *
+import git_ls_date
+from test_git_ls_date import create_repository
+
+if sys.version_info < (3, 5):
+    raise SkipTest("asyncio API requires Python 3.5 or higher.")
+
+import asyncio
+import git_ls_date_async
+
+# this module has no async syntax, so it is compiled and skipped on older Pythons.
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def run_in_order(*factories):
+    """run awaitables made by factories one by one on one event loop.
+    Return : list of results
+    """
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return [loop.run_until_complete(factory()) for factory in factories]
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+class TestAsyncLsDate(object):
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.repo = create_repository([
+            [["add", "a", "a"], ["add", "b", "b"]],
+            [["add", "a", "aa"]],
+        ])
+        self.hashes = git_ls_date.git("log --reverse --pretty=format:%h").split("\n")
+        os.chdir(self.cwd)
+
+    def teardown(self):
+        shutil.rmtree(self.repo)
+
+    def test_git(self):
+        eq_(run(git_ls_date_async.git("ls-files", cwd = self.repo)), "a\nb\n")
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_git_raise(self):
+        run(git_ls_date_async.git("hoge", cwd = self.repo))
+
+    def test_ls_date(self):
+        records = run(git_ls_date_async.ls_date(repo = self.repo, date = "raw"))
+
+        eq_([r.path for r in records], ["a", "b"])
+        eq_((records[0].first.hash, records[0].last.hash), (self.hashes[0], self.hashes[1]))
+        eq_(records[1].last.date, "1383000000 +0900")
+
+    def test_coalesce(self):
+        lister = git_ls_date_async.AsyncLsDate(self.repo, max_processes = 2)
+
+        results, last = run_in_order(
+            lambda: asyncio.gather(*[lister.ls_date([path]) for path in ["a", "b", "."] * 20]),
+            # commits are kept until HEAD moves.
+            lambda: lister.ls_date(["a"]))
+        results.append(last)
+
+        eq_(lister.walks_count, 1)
+        eq_(results[0][0].first.hash, self.hashes[0])
+        eq_([r.path for r in results[2]], ["a", "b"])
+        eq_(results[-1][0].last.hash, self.hashes[1])
+
+    @raises(git_ls_date.GitCommandErrorException)
+    def test_date_option_error(self):
+        git_ls_date_async.AsyncLsDate(self.repo, date = "hoge")